@@ -1,24 +1,32 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
-from pydantic import BaseModel, Field, validator
-from typing import Dict, List, Optional, Any
-import sys
-from pathlib import Path
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ConfigDict, StringConstraints, ValidationError, field_validator
+from typing import Annotated, Dict, List, Literal, Optional, Any
+import asyncio
+import logging
+import orjson
+import os
+import time
+from datetime import datetime, timezone
 
-# Add src to path for imports
-project_root = Path(__file__).parent.parent.parent
-sys.path.append(str(project_root))
+from backend.app.schema_docs import ENHANCED_CHAT_MESSAGE_DOCS, USER_PREFERENCES_DOCS, with_descriptions
+from backend.app.session_store import SessionStore
+
+logger = logging.getLogger(__name__)
 
 try:
     from src.enhanced_agent import EnhancedAgent as RealEnhancedAgent
     enhanced_agent_available = True
-    print("✅ Enhanced agent imported successfully")
+    logger.info("Enhanced agent imported successfully")
     
     # Use the real enhanced agent
     EnhancedAgent = RealEnhancedAgent
     
 except ImportError as e:
-    print(f"❌ Enhanced agent import failed: {e}")
+    logger.error("Enhanced agent import failed: %s", e)
     enhanced_agent_available = False
     
     # Create a dummy class for fallback
@@ -26,7 +34,7 @@ except ImportError as e:
         def __init__(self, *args, **kwargs):
             self.session_id = "dummy_session"
             self.user_id = "dummy_user"
-            self.memory_manager = type('MockMemoryManager', (), {'is_connected': lambda: False})()
+            self.memory_manager = type('MockMemoryManager', (), {'is_connected': staticmethod(lambda: False)})()
             self.context = {}
             
         def run(self, user_input: str, format_type: str = "markdown"):
@@ -35,6 +43,12 @@ except ImportError as e:
                 "metadata": {"error": True}
             }
             
+        async def arun(self, user_input: str, format_type: str = "markdown", executor=None):
+            return self.run(user_input, format_type)
+            
+        async def astream(self, user_input: str, format_type: str = "markdown", executor=None):
+            yield {"type": "final", "response": self.run(user_input, format_type)}
+            
         def get_conversation_summary(self):
             return {"turn_count": 0, "storage_type": "unavailable"}
             
@@ -58,27 +72,129 @@ router = APIRouter(prefix="/api/v2", tags=["Enhanced Chat"])
 # Also create a router for backward compatibility (no prefix)
 compat_router = APIRouter(tags=["Backward Compatibility"])
 
-# Global storage for enhanced agents (in production, consider Redis)
-enhanced_sessions: Dict[str, EnhancedAgent] = {}
+# Session storage: Redis-backed metadata (when REDIS_URL is set) fronted by a per-worker agent LRU
+enhanced_sessions = SessionStore(agent_factory=EnhancedAgent)
+
+async def get_agent(session_id: str, restore_user_id: Optional[str] = None) -> Optional[EnhancedAgent]:
+    """Look up a session agent; optionally restore it from MongoDB history when unknown"""
+    agent = await enhanced_sessions.get_agent(session_id)
+    if agent is None and restore_user_id is not None:
+        agent = EnhancedAgent(session_id=session_id, user_id=restore_user_id)
+        await enhanced_sessions.save(agent)
+        logger.debug("Restored agent for session: %s", session_id)
+    return agent
+
+# Blocking agent work (MongoDB reads/writes) goes here so the event loop stays free.
+# Turns await Gemini natively - including rate-limit backoff - and only use it around the API call.
+_agent_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("AGENT_POOL_SIZE", "32")),
+    thread_name_prefix="agent"
+)
+
+# Per-session turn locks: turns of one session run one at a time, in arrival
+# order (asyncio.Lock wakes waiters FIFO), while different sessions overlap.
+# Each entry is [lock, turns holding or waiting for it] and is dropped when idle.
+_session_locks: Dict[str, list] = {}
+
+@asynccontextmanager
+async def _session_turn(session_id: str):
+    """Hold the session's turn lock (plain and streamed turns alike)"""
+    entry = _session_locks.get(session_id)
+    if entry is None:
+        entry = _session_locks[session_id] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0 and _session_locks.get(session_id) is entry:
+            del _session_locks[session_id]
+
+async def _submit_chat(session_id: str, agent, user_input: str, format_type: str) -> Dict[str, Any]:
+    """Run a chat turn once the session's earlier turns have finished"""
+    async with _session_turn(session_id):
+        return await agent.arun(user_input, format_type, executor=_agent_pool)
+
+def _iso_now() -> str:
+    """Current UTC time as an ISO-8601 string; call once per response and reuse"""
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+# Shared agent for stateless endpoints (stats, cleanup, health) - only its memory_manager is used
+_stats_agent: Optional[EnhancedAgent] = None
+_stats_agent_lock = asyncio.Lock()
+
+async def _get_stats_agent() -> EnhancedAgent:
+    """Return the shared stats agent, creating it once on first use"""
+    global _stats_agent
+    if _stats_agent is None:
+        async with _stats_agent_lock:
+            if _stats_agent is None:
+                _stats_agent = EnhancedAgent(user_id="system")
+    return _stats_agent
+
+# MongoDB reachability, maintained by a background heartbeat so handlers never probe the database
+MONGO_HEARTBEAT_SECONDS = 5.0
+_mongo_up: bool = False
+_heartbeat_task: Optional[asyncio.Task] = None
+
+def _ping_mongo() -> bool:
+    """Ping MongoDB through the stats agent's client (blocking)"""
+    client = getattr(_stats_agent.memory_manager, "client", None) if _stats_agent else None
+    if client is None:
+        return False
+    try:
+        client.admin.command("ping")
+        return True
+    except Exception:
+        return False
+
+async def _mongo_heartbeat():
+    """Refresh _mongo_up every MONGO_HEARTBEAT_SECONDS"""
+    global _mongo_up
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(MONGO_HEARTBEAT_SECONDS)
+        _mongo_up = await loop.run_in_executor(None, _ping_mongo)
+
+@router.on_event("startup")
+async def warm_stats_agent():
+    """Build the stats agent at startup so the first request doesn't pay for it"""
+    global _mongo_up, _heartbeat_task
+    try:
+        agent = await _get_stats_agent()
+        _mongo_up = agent.memory_manager.is_connected()
+    except Exception as e:
+        logger.warning("Could not pre-warm stats agent: %s", e)
+    _heartbeat_task = asyncio.create_task(_mongo_heartbeat())
+
+@router.on_event("shutdown")
+async def stop_mongo_heartbeat():
+    """Cancel the heartbeat started by warm_stats_agent"""
+    global _heartbeat_task
+    if _heartbeat_task is not None:
+        _heartbeat_task.cancel()
+        try:
+            await _heartbeat_task
+        except asyncio.CancelledError:
+            pass
+        _heartbeat_task = None
 
 class EnhancedChatMessage(BaseModel):
-    message: str = Field(..., min_length=1, max_length=5000, description="User message content")
-    format_type: str = Field(default="markdown", description="Response format type")
-    user_id: Optional[str] = Field(default="anonymous", description="User identifier")
-    context: Optional[Dict[str, Any]] = Field(default=None, description="Additional context")
+    model_config = ConfigDict(json_schema_extra=with_descriptions(ENHANCED_CHAT_MESSAGE_DOCS))
     
-    @validator('format_type')
-    def validate_format_type(cls, v):
-        allowed_formats = ["markdown", "json", "table"]
-        if v not in allowed_formats:
-            raise ValueError(f"format_type must be one of: {allowed_formats}")
-        return v
+    message: Annotated[str, StringConstraints(min_length=1, max_length=5000)]
+    format_type: Literal["markdown", "json", "table"] = "markdown"
+    user_id: Optional[str] = "anonymous"
+    context: Optional[Dict[str, Any]] = None
     
-    @validator('message')
-    def validate_message(cls, v):
-        if not v.strip():
+    @field_validator('message', mode='after')
+    @classmethod
+    def validate_message(cls, v: str) -> str:
+        v = v.strip()
+        if not v:
             raise ValueError("Message cannot be empty or whitespace only")
-        return v.strip()
+        return v
 
 class EnhancedChatResponse(BaseModel):
     response: Dict[str, Any]
@@ -88,17 +204,22 @@ class EnhancedChatResponse(BaseModel):
 class SessionStats(BaseModel):
     session_id: str
     turn_count: int
-    first_message: Optional[str]
-    last_message: Optional[str]
+    first_message: Optional[datetime]
+    last_message: Optional[datetime]
     agent_status: str
     storage_type: str
     user_id: str
 
 class UserPreferences(BaseModel):
-    response_style: Optional[str] = Field(default="detailed", description="Response style preference")
-    technical_level: Optional[str] = Field(default="intermediate", description="Technical complexity level")
-    language: Optional[str] = Field(default="english", description="Preferred language")
-    domain: Optional[str] = Field(default="general", description="Primary domain of interest")
+    model_config = ConfigDict(json_schema_extra=with_descriptions(USER_PREFERENCES_DOCS))
+    
+    response_style: Optional[str] = "detailed"
+    technical_level: Optional[str] = "intermediate"
+    language: Optional[str] = "english"
+    domain: Optional[str] = "general"
+
+# UserPreferences fields, read with getattr instead of walking model_dump()
+_PREF_FIELDS = ("response_style", "technical_level", "language", "domain")
 
 class DatabaseStats(BaseModel):
     connected: bool
@@ -107,79 +228,102 @@ class DatabaseStats(BaseModel):
     storage_type: str
     database_size_mb: Optional[float] = None
     index_size_mb: Optional[float] = None
+    heartbeat_connected: Optional[bool] = None
 
-@router.post("/session/create", response_model=Dict[str, str])
+@router.post("/session/create", response_model=Dict[str, str], response_model_exclude_unset=True)
 async def create_enhanced_session(user_id: str = Query(default="anonymous", description="User identifier")):
     """Create a new enhanced session with MongoDB memory and guardrails"""
     try:
         agent = EnhancedAgent(user_id=user_id)
         session_id = agent.session_id
-        enhanced_sessions[session_id] = agent
-        
-        # Get database connection status
-        db_connected = agent.memory_manager.is_connected()
+        if not await enhanced_sessions.create(agent):
+            raise HTTPException(status_code=409, detail="Session already exists")
         
         return {
             "session_id": session_id,
             "user_id": user_id,
             "message": "Enhanced session created successfully",
             "features": "✅ Memory, ✅ Guardrails, ✅ Structured Output, ✅ Context Management",
-            "database_connected": str(db_connected),
-            "storage_type": "mongodb" if db_connected else "memory_fallback",
-            "created_at": datetime.now().isoformat()
+            "database_connected": str(_mongo_up),
+            "storage_type": "mongodb" if _mongo_up else "memory_fallback",
+            "created_at": _iso_now()
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500, 
             detail=f"Failed to create enhanced session: {str(e)}"
         )
 
-@router.post("/chat/{session_id}", response_model=EnhancedChatResponse)
-async def enhanced_chat(session_id: str, message: EnhancedChatMessage):
+# Constant feature flags reported with every chat response
+_CHAT_STATIC_FEATURES = {
+    "guardrails_active": True,
+    "context_aware": True,
+    "structured_output": True,
+    "safety_filters": True
+}
+
+async def _parse_body(request: Request, model):
+    """Validate the raw request body in one pydantic-core pass (no json.loads -> dict hop)"""
+    try:
+        return model.model_validate_json(await request.body())
+    except ValidationError as e:
+        # Same shape as FastAPI's own body validation errors
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)]
+        )
+
+def _json_body(model) -> Dict[str, Any]:
+    """openapi_extra documenting a request body that the handler parses itself"""
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": model.model_json_schema()}}
+        }
+    }
+
+# Hot endpoints return plain dicts (no outbound model validation); models are kept for the docs only
+@router.post(
+    "/chat/{session_id}",
+    responses={200: {"model": EnhancedChatResponse}},
+    openapi_extra=_json_body(EnhancedChatMessage)
+)
+async def enhanced_chat(session_id: str, request: Request):
     """Enhanced chat with MongoDB memory, guardrails, and structured output"""
+    message = await _parse_body(request, EnhancedChatMessage)
     
     # Get or recreate agent
-    if session_id not in enhanced_sessions:
-        try:
-            # Try to recreate agent from stored session
-            agent = EnhancedAgent(session_id=session_id, user_id=message.user_id or "anonymous")
-            enhanced_sessions[session_id] = agent
-            print(f"🔄 Restored agent for session: {session_id}")
-        except Exception as e:
-            raise HTTPException(
-                status_code=404, 
-                detail=f"Session not found and could not be restored: {str(e)}"
-            )
-    
-    agent = enhanced_sessions[session_id]
+    try:
+        agent = await get_agent(session_id, restore_user_id=message.user_id or "anonymous")
+    except Exception as e:
+        raise HTTPException(
+            status_code=404, 
+            detail=f"Session not found and could not be restored: {str(e)}"
+        )
     
     try:
         # Update agent context if provided
         if message.context:
             agent.context.update(message.context)
+            await enhanced_sessions.save(agent)
+        else:
+            await enhanced_sessions.touch(session_id)
         
         # Process message with full enhancement pipeline
-        response = agent.run(
-            user_input=message.message,
-            format_type=message.format_type
-        )
+        response = await _submit_chat(session_id, agent, message.message, message.format_type)
         
         # Add enhanced metadata
+        db_connected = _mongo_up
         enhanced_metadata = {
             "timestamp": response["metadata"].get("timestamp"),
             "format_type": message.format_type,
             "session_info": {
                 "session_id": session_id,
-                "user_id": agent.user_id,
-                "database_connected": agent.memory_manager.is_connected()
-            },
-            "enhanced_features": {
-                "guardrails_active": True,
-                "memory_persistent": agent.memory_manager.is_connected(),
-                "context_aware": True,
-                "structured_output": True,
-                "safety_filters": True
+                "user_id": enhanced_sessions.user_ids.get(session_id, "anonymous"),
+                "database_connected": db_connected
             },
+            "enhanced_features": {"memory_persistent": db_connected, **_CHAT_STATIC_FEATURES},
             "performance": {
                 "processing_time": response["metadata"].get("processing_time"),
                 "response_length": len(response["response"]["content"]),
@@ -187,11 +331,11 @@ async def enhanced_chat(session_id: str, message: EnhancedChatMessage):
             }
         }
         
-        return EnhancedChatResponse(
-            response=response,
-            session_id=session_id,
-            metadata=enhanced_metadata
-        )
+        return {
+            "response": response,
+            "session_id": session_id,
+            "metadata": enhanced_metadata
+        }
         
     except Exception as e:
         raise HTTPException(
@@ -199,16 +343,41 @@ async def enhanced_chat(session_id: str, message: EnhancedChatMessage):
             detail=f"Error processing enhanced message: {str(e)}"
         )
 
-@router.get("/session/{session_id}/stats", response_model=SessionStats)
+@router.post("/chat/{session_id}/stream", openapi_extra=_json_body(EnhancedChatMessage))
+async def enhanced_chat_stream(session_id: str, request: Request):
+    """Stream a chat response as newline-delimited JSON: token events, then the final structured response"""
+    message = await _parse_body(request, EnhancedChatMessage)
+    
+    try:
+        agent = await get_agent(session_id, restore_user_id=message.user_id or "anonymous")
+    except Exception as e:
+        raise HTTPException(
+            status_code=404, 
+            detail=f"Session not found and could not be restored: {str(e)}"
+        )
+    
+    if message.context:
+        agent.context.update(message.context)
+        await enhanced_sessions.save(agent)
+    else:
+        await enhanced_sessions.touch(session_id)
+    
+    async def events():
+        # The whole stream is one turn: later turns of the session wait until it finishes
+        async with _session_turn(session_id):
+            async for event in agent.astream(message.message, message.format_type, executor=_agent_pool):
+                yield orjson.dumps(event) + b"\n"
+    
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@router.get("/session/{session_id}/stats", response_model=SessionStats, response_model_exclude_unset=True)
 async def get_session_stats(session_id: str):
     """Get detailed session statistics and summary"""
     
-    agent = None
-    
     # Try to get from active sessions first
-    if session_id in enhanced_sessions:
-        agent = enhanced_sessions[session_id]
-    else:
+    agent = await get_agent(session_id)
+    is_active = agent is not None
+    if agent is None:
         # Try to create agent to access stored data
         try:
             agent = EnhancedAgent(session_id=session_id)
@@ -223,7 +392,7 @@ async def get_session_stats(session_id: str):
             turn_count=summary.get("turn_count", 0),
             first_message=summary.get("first_message"),
             last_message=summary.get("last_message"),
-            agent_status="active" if session_id in enhanced_sessions else "restored",
+            agent_status="active" if is_active else "restored",
             storage_type=summary.get("storage_type", "unknown"),
             user_id=summary.get("user_id", "unknown")
         )
@@ -234,19 +403,16 @@ async def get_session_stats(session_id: str):
             detail=f"Error retrieving session stats: {str(e)}"
         )
 
-@router.get("/session/{session_id}/history", response_model=List[Dict[str, str]])
+@router.get("/session/{session_id}/history", responses={200: {"model": List[Dict[str, str]]}})
 async def get_enhanced_history(
     session_id: str, 
     limit: int = Query(default=20, ge=1, le=100, description="Number of messages to retrieve")
 ):
     """Get conversation history with enhanced context"""
     
-    agent = None
-    
     # Try to get from active sessions first
-    if session_id in enhanced_sessions:
-        agent = enhanced_sessions[session_id]
-    else:
+    agent = await get_agent(session_id)
+    if agent is None:
         # Try to create agent to access stored data
         try:
             agent = EnhancedAgent(session_id=session_id)
@@ -263,25 +429,25 @@ async def get_enhanced_history(
             detail=f"Error retrieving conversation history: {str(e)}"
         )
 
-@router.put("/session/{session_id}/preferences", response_model=Dict[str, str])
+@router.put("/session/{session_id}/preferences", response_model=Dict[str, str], response_model_exclude_unset=True)
 async def update_user_preferences(session_id: str, preferences: UserPreferences):
     """Update user preferences for the session"""
     
-    if session_id not in enhanced_sessions:
+    agent = await get_agent(session_id)
+    if agent is None:
         raise HTTPException(status_code=404, detail="Active session not found")
     
-    agent = enhanced_sessions[session_id]
-    
     try:
         # Convert to dict and filter out None values
-        prefs_dict = {k: v for k, v in preferences.dict().items() if v is not None}
+        prefs_dict = {f: v for f in _PREF_FIELDS if (v := getattr(preferences, f)) is not None}
         agent.update_preferences(prefs_dict)
+        await enhanced_sessions.save(agent)
         
         return {
             "message": "Preferences updated successfully",
             "session_id": session_id,
             "updated_preferences": str(prefs_dict),
-            "timestamp": datetime.now().isoformat()
+            "timestamp": _iso_now()
         }
         
     except Exception as e:
@@ -294,16 +460,12 @@ async def update_user_preferences(session_id: str, preferences: UserPreferences)
 async def delete_enhanced_session(session_id: str):
     """Delete enhanced session from memory (MongoDB history preserved)"""
     
-    if session_id in enhanced_sessions:
-        # Cleanup agent
-        agent = enhanced_sessions[session_id]
-        del enhanced_sessions[session_id]
-        
+    if await enhanced_sessions.delete(session_id):
         return {
             "message": "Session deleted from memory successfully",
             "note": "Conversation history preserved in MongoDB",
             "session_id": session_id,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": _iso_now()
         }
     else:
         raise HTTPException(status_code=404, detail="Active session not found in memory")
@@ -312,11 +474,10 @@ async def delete_enhanced_session(session_id: str):
 async def clear_session_context(session_id: str):
     """Clear session context while keeping persistent history"""
     
-    if session_id not in enhanced_sessions:
+    agent = await get_agent(session_id)
+    if agent is None:
         raise HTTPException(status_code=404, detail="Active session not found")
     
-    agent = enhanced_sessions[session_id]
-    
     try:
         agent.clear_conversation()
         
@@ -324,7 +485,7 @@ async def clear_session_context(session_id: str):
             "message": "Session context cleared successfully",
             "note": "Full conversation history still available in MongoDB",
             "session_id": session_id,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": _iso_now()
         }
         
     except Exception as e:
@@ -333,15 +494,14 @@ async def clear_session_context(session_id: str):
             detail=f"Error clearing session context: {str(e)}"
         )
 
-@router.get("/database/stats", response_model=DatabaseStats)
+@router.get("/database/stats", response_model=DatabaseStats, response_model_exclude_unset=True)
 async def get_database_stats():
     """Get MongoDB database statistics"""
     try:
-        # Create a temporary agent to access database stats
-        temp_agent = EnhancedAgent()
-        stats = temp_agent.get_database_stats()
+        agent = await _get_stats_agent()
+        stats = agent.get_database_stats()
         
-        return DatabaseStats(**stats)
+        return DatabaseStats(**stats, heartbeat_connected=_mongo_up)
         
     except Exception as e:
         raise HTTPException(
@@ -353,15 +513,14 @@ async def get_database_stats():
 async def cleanup_old_data(days_old: int = Query(default=30, ge=1, le=365, description="Days old for cleanup")):
     """Clean up conversations older than specified days"""
     try:
-        # Create a temporary agent to perform cleanup
-        temp_agent = EnhancedAgent()
-        deleted_count = temp_agent.cleanup_old_data(days_old)
+        agent = await _get_stats_agent()
+        deleted_count = agent.cleanup_old_data(days_old)
         
         return {
             "message": f"Database cleanup completed successfully",
             "deleted_conversations": deleted_count,
             "cutoff_days": days_old,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": _iso_now()
         }
         
     except Exception as e:
@@ -377,15 +536,15 @@ async def get_user_sessions(
 ):
     """Get all sessions for a specific user"""
     try:
-        # Create a temporary agent to access user sessions
-        temp_agent = EnhancedAgent(user_id=user_id)
-        sessions = temp_agent.memory_manager.get_user_sessions(user_id, limit)
+        # Session lookup is stateless in user_id, so the shared agent serves every user
+        agent = await _get_stats_agent()
+        sessions = agent.memory_manager.get_user_sessions(user_id, limit)
         
         return {
             "user_id": user_id,
             "sessions": sessions,
             "total_found": len(sessions),
-            "timestamp": datetime.now().isoformat()
+            "timestamp": _iso_now()
         }
         
     except Exception as e:
@@ -394,25 +553,56 @@ async def get_user_sessions(
             detail=f"Error retrieving user sessions: {str(e)}"
         )
 
+# Liveness probes can hit /health every few seconds - serve a body cached for this long
+HEALTH_CACHE_SECONDS = 1.0
+_health_cache: tuple = (0.0, None)  # (cached_at, body)
+_health_lock = asyncio.Lock()
+
+# Database stats change slowly; refresh them at most this often for /health
+DB_STATS_CACHE_SECONDS = 30.0
+_db_stats_cache: tuple = (0.0, None)  # (cached_at, stats)
+
+# Constant parts of the health body, built once at import
+_HEALTH_VERSION = "2.0.0"
+_HEALTH_STATIC_FEATURES = {
+    "guardrails": True,
+    "structured_prompts": True,
+    "context_management": True,
+    "safety_filters": True
+}
+
 @router.get("/health")
 async def health_check():
     """Health check endpoint for the enhanced system"""
+    global _health_cache
+    cached_at, body = _health_cache
+    if body is not None and time.monotonic() - cached_at < HEALTH_CACHE_SECONDS:
+        return body
+    
+    async with _health_lock:
+        # Another request may have refreshed the cache while we waited
+        cached_at, body = _health_cache
+        if body is None or time.monotonic() - cached_at >= HEALTH_CACHE_SECONDS:
+            body = await _build_health()
+            _health_cache = (time.monotonic(), body)
+    return body
+
+async def _build_health() -> Dict[str, Any]:
+    """Build the health check response body"""
+    global _db_stats_cache
     try:
-        # Test MongoDB connection
-        temp_agent = EnhancedAgent()
-        db_stats = temp_agent.get_database_stats()
+        # Test MongoDB connection (cached)
+        cached_at, db_stats = _db_stats_cache
+        if db_stats is None or time.monotonic() - cached_at >= DB_STATS_CACHE_SECONDS:
+            agent = await _get_stats_agent()
+            db_stats = agent.get_database_stats()
+            _db_stats_cache = (time.monotonic(), db_stats)
         
         return {
             "status": "healthy",
-            "timestamp": datetime.now().isoformat(),
-            "version": "2.0.0",
-            "features": {
-                "mongodb_memory": db_stats["connected"],
-                "guardrails": True,
-                "structured_prompts": True,
-                "context_management": True,
-                "safety_filters": True
-            },
+            "timestamp": _iso_now(),
+            "version": _HEALTH_VERSION,
+            "features": {"mongodb_memory": db_stats["connected"], **_HEALTH_STATIC_FEATURES},
             "active_sessions": len(enhanced_sessions),
             "database": {
                 "connected": db_stats["connected"],
@@ -425,7 +615,7 @@ async def health_check():
         return {
             "status": "degraded",
             "error": str(e),
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": _iso_now(),
             "active_sessions": len(enhanced_sessions)
         }
 
@@ -444,14 +634,15 @@ class LegacySessionResponse(BaseModel):
     session_id: str
     message: str
 
-@compat_router.post("/session/create", response_model=LegacySessionResponse)
+@compat_router.post("/session/create", response_model=LegacySessionResponse, response_model_exclude_unset=True)
 async def create_legacy_session():
     """Create a session with enhanced features but legacy response format"""
     try:
         if enhanced_agent_available:
             agent = EnhancedAgent(user_id="frontend_user")
             session_id = agent.session_id
-            enhanced_sessions[session_id] = agent
+            if not await enhanced_sessions.create(agent):
+                raise HTTPException(status_code=409, detail="Session already exists")
             
             return LegacySessionResponse(
                 session_id=session_id,
@@ -465,96 +656,70 @@ async def create_legacy_session():
                 session_id=session_id,
                 message="Basic session created (enhanced features unavailable)"
             )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create session: {str(e)}")
 
-@compat_router.post("/chat/{session_id}", response_model=LegacyChatResponse)
-async def legacy_chat(session_id: str, message: LegacyChatMessage):
-    """Enhanced chat with legacy response format for frontend compatibility"""
+async def _enhanced_legacy_chat(session_id: str, message: LegacyChatMessage) -> Dict[str, str]:
+    """Legacy chat backed by an enhanced agent (restored on the fly for unknown sessions)"""
+    try:
+        agent = await get_agent(session_id, restore_user_id="frontend_user")
+        response = await _submit_chat(session_id, agent, message.message, "markdown")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Enhanced chat error: {str(e)}")
     
-    if enhanced_agent_available and session_id in enhanced_sessions:
-        try:
-            # Use enhanced agent
-            agent = enhanced_sessions[session_id]
-            
-            response = agent.run(
-                user_input=message.message,
-                format_type="markdown"
-            )
-            
-            # Extract just the content for legacy response
-            content = response["response"]["content"]
-            
-            return LegacyChatResponse(
-                response=content,
-                session_id=session_id
-            )
-            
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Enhanced chat error: {str(e)}")
-    else:
-        # Fallback to basic response
-        try:
-            # Try to create an enhanced agent on-the-fly
-            if enhanced_agent_available:
-                agent = EnhancedAgent(session_id=session_id, user_id="frontend_user")
-                enhanced_sessions[session_id] = agent
-                
-                response = agent.run(
-                    user_input=message.message,
-                    format_type="markdown"
-                )
-                
-                content = response["response"]["content"]
-                
-                return LegacyChatResponse(
-                    response=content,
-                    session_id=session_id
-                )
-            else:
-                # Use the basic agent from the main backend
-                try:
-                    from backend.main import sessions
-                    if session_id in sessions:
-                        agent = sessions[session_id]
-                        response_text = agent.run(message.message)
-                        return LegacyChatResponse(
-                            response=response_text,
-                            session_id=session_id
-                        )
-                    else:
-                        return LegacyChatResponse(
-                            response=f"Session {session_id} not found. Please create a new session.",
-                            session_id=session_id
-                        )
-                except Exception as basic_error:
-                    return LegacyChatResponse(
-                        response=f"I received your message: '{message.message}'. Enhanced features are currently unavailable. Basic agent error: {str(basic_error)}",
-                        session_id=session_id
-                    )
-                
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Fallback chat error: {str(e)}")
+    # Extract just the content for legacy response
+    return {
+        "response": response["response"]["content"],
+        "session_id": session_id
+    }
+
+async def _basic_legacy_chat(session_id: str, message: LegacyChatMessage) -> Dict[str, str]:
+    """Legacy chat backed by the basic agent sessions when enhanced features are unavailable"""
+    try:
+        from backend.app.legacy_routes import sessions
+        if session_id not in sessions:
+            return {
+                "response": f"Session {session_id} not found. Please create a new session.",
+                "session_id": session_id
+            }
+        response_text = await sessions[session_id].arun(message.message)
+        return {
+            "response": response_text,
+            "session_id": session_id
+        }
+    except Exception as basic_error:
+        return {
+            "response": f"I received your message: '{message.message}'. Enhanced features are currently unavailable. Basic agent error: {str(basic_error)}",
+            "session_id": session_id
+        }
+
+# Which backend serves legacy chat only depends on the enhanced agent import, so pick it once
+_legacy_chat_handler = _enhanced_legacy_chat if enhanced_agent_available else _basic_legacy_chat
+
+@compat_router.post(
+    "/chat/{session_id}",
+    responses={200: {"model": LegacyChatResponse}},
+    openapi_extra=_json_body(LegacyChatMessage)
+)
+async def legacy_chat(session_id: str, request: Request):
+    """Enhanced chat with legacy response format for frontend compatibility"""
+    message = await _parse_body(request, LegacyChatMessage)
+    return await _legacy_chat_handler(session_id, message)
 
 @compat_router.get("/history/{session_id}")
 async def get_legacy_history(session_id: str):
     """Get conversation history in legacy format"""
     
-    if enhanced_agent_available and session_id in enhanced_sessions:
+    agent = await get_agent(session_id) if enhanced_agent_available else None
+    if agent is not None:
         try:
-            agent = enhanced_sessions[session_id]
+            # History entries are already {role, content} - the legacy format
             history = agent.get_full_history(limit=20)
             
-            # Convert to legacy format
-            legacy_history = []
-            for msg in history:
-                legacy_history.append({
-                    "role": msg["role"],
-                    "content": msg["content"]
-                })
-            
             return {
-                "history": legacy_history,
+                "history": history,
                 "session_id": session_id
             }
             
@@ -0,0 +1,92 @@
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+from typing import List, Dict
+import uuid
+
+from src.agent import SimpleAgent, close_scheduler
+
+# Basic (v1) chat routes backed by SimpleAgent
+legacy_router = APIRouter(tags=["Basic Chat"])
+
+# In-memory storage for sessions (in production, use Redis or database)
+sessions: Dict[str, SimpleAgent] = {}
+
+class ChatMessage(BaseModel):
+    message: str
+
+class ChatResponse(BaseModel):
+    response: str
+    session_id: str
+
+class SessionResponse(BaseModel):
+    session_id: str
+    message: str
+
+class HistoryResponse(BaseModel):
+    history: List[Dict[str, str]]
+    session_id: str
+
+@legacy_router.on_event("shutdown")
+async def stop_batch_scheduler():
+    """Cancel queued batched prompts and wait for in-flight Gemini batches"""
+    await close_scheduler()
+
+@legacy_router.post("/session/create", response_model=SessionResponse)
+async def create_session():
+    """Create a new chat session"""
+    try:
+        session_id = str(uuid.uuid4())
+        agent = SimpleAgent()
+        sessions[session_id] = agent
+
+        return SessionResponse(
+            session_id=session_id,
+            message="Session created successfully"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to create session: {str(e)}")
+
+@legacy_router.post("/chat/{session_id}", response_model=ChatResponse)
+async def chat(session_id: str, message: ChatMessage):
+    """Send a message to the agent and get a response"""
+    if session_id not in sessions:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    try:
+        agent = sessions[session_id]
+        response = await agent.arun(message.message)
+
+        return ChatResponse(
+            response=response,
+            session_id=session_id
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
+
+@legacy_router.get("/history/{session_id}", response_model=HistoryResponse)
+async def get_history(session_id: str):
+    """Get conversation history for a session"""
+    if session_id not in sessions:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    agent = sessions[session_id]
+    history = agent.get_history()
+
+    return HistoryResponse(
+        history=history,
+        session_id=session_id
+    )
+
+@legacy_router.delete("/session/{session_id}")
+async def delete_session(session_id: str):
+    """Delete a chat session"""
+    if session_id not in sessions:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    del sessions[session_id]
+    return {"message": "Session deleted successfully"}
+
+@legacy_router.get("/sessions")
+async def list_sessions():
+    """List all active sessions (for debugging)"""
+    return {"sessions": list(sessions.keys()), "count": len(sessions)}
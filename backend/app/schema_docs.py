@@ -0,0 +1,27 @@
+from typing import Any, Callable, Dict
+
+# Field descriptions for request models. They only matter for the OpenAPI docs,
+# so they're attached at schema-generation time instead of living on the runtime models.
+
+ENHANCED_CHAT_MESSAGE_DOCS = {
+    "message": "User message content",
+    "format_type": "Response format type",
+    "user_id": "User identifier",
+    "context": "Additional context"
+}
+
+USER_PREFERENCES_DOCS = {
+    "response_style": "Response style preference",
+    "technical_level": "Technical complexity level",
+    "language": "Preferred language",
+    "domain": "Primary domain of interest"
+}
+
+def with_descriptions(descriptions: Dict[str, str]) -> Callable[[Dict[str, Any], Any], None]:
+    """Build a json_schema_extra hook that adds field descriptions to a model's JSON schema"""
+    def _apply(schema: Dict[str, Any], model: Any) -> None:
+        properties = schema.get("properties", {})
+        for name, text in descriptions.items():
+            if name in properties:
+                properties[name].setdefault("description", text)
+    return _apply
@@ -0,0 +1,234 @@
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+import logging
+import orjson
+import os
+import threading
+import time
+
+# Redis is optional - without it sessions live only in this worker's LRU cache
+try:
+    import redis.asyncio as aioredis
+    redis_available = True
+except ImportError:
+    aioredis = None
+    redis_available = False
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY_PREFIX = "sess:"
+DEFAULT_SESSION_TTL = 3600          # seconds a session survives without activity
+DEFAULT_MAX_CACHED_AGENTS = 10_000  # hydrated agents kept per worker
+
+
+class SessionStore:
+    """Redis-backed session metadata store fronted by an in-process LRU of hydrated agents.
+
+    Redis holds the small, serializable part of a session (user_id, context
+    incl. preferences, created_at) as a hash so every worker can see it. The
+    expensive part - the agent object itself - is rebuilt on demand and cached
+    locally, bounded by max_cached_agents and evicted after ttl seconds idle.
+    Evicted agents are restored from Redis/MongoDB on their next request.
+
+    Every create/save/touch bumps a version field in the hash. A local cache hit
+    is only served while Redis still has the session at the version this worker
+    last saw; otherwise the agent is dropped (deleted elsewhere) or rebuilt
+    (changed or used by another worker, so its context and history are reloaded).
+    """
+
+    def __init__(self,
+                 agent_factory: Callable[..., Any],
+                 redis_url: Optional[str] = None,
+                 ttl: int = DEFAULT_SESSION_TTL,
+                 max_cached_agents: int = DEFAULT_MAX_CACHED_AGENTS):
+        self._agent_factory = agent_factory
+        self.ttl = ttl
+        self.max_cached_agents = max_cached_agents
+        self._agents: "OrderedDict[str, Any]" = OrderedDict()
+        self._last_access: Dict[str, float] = {}
+        self._versions: Dict[str, int] = {}  # Redis version each cached agent was built from
+        self._lock = threading.RLock()
+        
+        # Hot per-session fields kept as a flat dict so request handlers read
+        # primitives instead of chasing agent attribute chains
+        self.user_ids: Dict[str, str] = {}
+
+        redis_url = redis_url or os.getenv("REDIS_URL")
+        self.redis = None
+        if redis_url and redis_available:
+            self.redis = aioredis.from_url(redis_url, decode_responses=True)
+            logger.info("Redis session store enabled")
+        elif redis_url:
+            logger.warning("REDIS_URL set but redis package not installed - using in-process sessions")
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            self._purge_expired()
+            return session_id in self._agents
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._purge_expired()
+            return len(self._agents)
+
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"{SESSION_KEY_PREFIX}{session_id}"
+
+    def _remember(self, session_id: str, agent: Any, version: Optional[int] = None):
+        """Cache a hydrated agent locally, evicting the least recently used one"""
+        with self._lock:
+            if version is not None:
+                self._versions[session_id] = version
+            self._agents[session_id] = agent
+            self._agents.move_to_end(session_id)
+            self._last_access[session_id] = time.monotonic()
+            self.user_ids[session_id] = agent.user_id
+            while len(self._agents) > self.max_cached_agents:
+                self._evict(next(iter(self._agents)))
+            self._purge_expired()
+
+    def _purge_expired(self):
+        """Evict agents idle for longer than ttl (oldest are at the front of the LRU)"""
+        cutoff = time.monotonic() - self.ttl
+        while self._agents:
+            oldest_id = next(iter(self._agents))
+            if self._last_access.get(oldest_id, 0.0) > cutoff:
+                break
+            self._evict(oldest_id)
+
+    def _evict(self, session_id: str):
+        # Nothing to write out: turns are saved through the shared memory manager,
+        # which flushes its own write buffer
+        self._agents.pop(session_id, None)
+        self._forget(session_id)
+
+    def _forget(self, session_id: str):
+        self._last_access.pop(session_id, None)
+        self._versions.pop(session_id, None)
+        self.user_ids.pop(session_id, None)
+
+    @staticmethod
+    def _serialize(agent: Any) -> Dict[str, str]:
+        return {"user_id": agent.user_id, "context": orjson.dumps(agent.context).decode()}
+
+    async def _load_metadata(self, session_id: str) -> Optional[Dict[str, Any]]:
+        if self.redis is None:
+            return None
+        try:
+            metadata = await self.redis.hgetall(self._key(session_id))
+        except Exception as e:
+            logger.warning("Redis lookup failed, using local sessions only: %s", e)
+            return None
+        if not metadata or "user_id" not in metadata:
+            return None
+        metadata["context"] = orjson.loads(metadata.get("context") or "{}")
+        return metadata
+
+    async def _is_current(self, session_id: str) -> Optional[bool]:
+        """Whether the cached agent still matches Redis; None if the session is gone there"""
+        try:
+            user_id, version = await self.redis.hmget(self._key(session_id), "user_id", "version")
+        except Exception as e:
+            logger.warning("Redis lookup failed, serving the local session: %s", e)
+            return True
+        if user_id is None:
+            return None
+        with self._lock:
+            return int(version or 0) == self._versions.get(session_id)
+
+    async def get_agent(self, session_id: str) -> Optional[Any]:
+        """Return the agent for a session, hydrating it from Redis if needed"""
+        with self._lock:
+            self._purge_expired()
+            agent = self._agents.get(session_id)
+            if agent is not None:
+                self._agents.move_to_end(session_id)
+                self._last_access[session_id] = time.monotonic()
+                if self.redis is None:
+                    return agent
+
+        if agent is not None:
+            current = await self._is_current(session_id)
+            if current:
+                return agent
+            with self._lock:
+                if current is None:
+                    # Deleted or expired by another worker
+                    self._agents.pop(session_id, None)
+                    self._forget(session_id)
+                    return None
+                # Changed by another worker: rebuild from Redis/MongoDB below
+                if self._agents.get(session_id) is agent:
+                    self._evict(session_id)
+
+        metadata = await self._load_metadata(session_id)
+        if metadata is None:
+            return None
+
+        agent = self._agent_factory(session_id=session_id, user_id=metadata["user_id"])
+        agent.context.update(metadata.get("context", {}))
+        self._remember(session_id, agent, int(metadata.get("version") or 0))
+        return agent
+
+    async def create(self, agent: Any) -> bool:
+        """Register a new session; returns False if the session id was already taken"""
+        created = True
+        if self.redis is not None:
+            key = self._key(agent.session_id)
+            try:
+                # HSETNX on created_at is the race guard between workers
+                created = bool(await self.redis.hsetnx(key, "created_at", datetime.now().isoformat()))
+                if created:
+                    await self.redis.hset(key, mapping={**self._serialize(agent), "version": 1})
+                    await self.redis.expire(key, self.ttl)
+            except Exception as e:
+                logger.warning("Redis create failed, session kept locally: %s", e)
+        if created:
+            self._remember(agent.session_id, agent, 1)
+        return created
+
+    async def save(self, agent: Any):
+        """Persist the agent's context after it changed (preferences, extra context)"""
+        self._remember(agent.session_id, agent)
+        if self.redis is None:
+            return
+        key = self._key(agent.session_id)
+        try:
+            await self.redis.hset(key, mapping=self._serialize(agent))
+            await self._bump(agent.session_id)
+        except Exception as e:
+            logger.warning("Redis save failed: %s", e)
+
+    async def touch(self, session_id: str):
+        """Extend the session expiry on activity (a new turn makes other workers' copies stale)"""
+        if self.redis is None:
+            return
+        try:
+            await self._bump(session_id)
+        except Exception as e:
+            logger.warning("Redis touch failed: %s", e)
+
+    async def _bump(self, session_id: str):
+        """Increment the session version and expiry, recording the new version locally"""
+        key = self._key(session_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hincrby(key, "version", 1)
+            pipe.expire(key, self.ttl)
+            version, _ = await pipe.execute()
+        with self._lock:
+            if session_id in self._agents:
+                self._versions[session_id] = int(version)
+
+    async def delete(self, session_id: str) -> bool:
+        """Remove a session everywhere; returns whether it existed"""
+        with self._lock:
+            existed = self._agents.pop(session_id, None) is not None
+            self._forget(session_id)
+        if self.redis is not None:
+            try:
+                existed = bool(await self.redis.delete(self._key(session_id))) or existed
+            except Exception as e:
+                logger.warning("Redis delete failed: %s", e)
+        return existed
@@ -1,48 +1,99 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Deque, Tuple
+from collections import OrderedDict, deque
+import asyncio
+import hashlib
 import os
 import time
 import random
-from google import generativeai
-from dotenv import load_dotenv
-import pathlib
+import threading
+import orjson
+
+from .batch_scheduler import BatchScheduler
+from .env import ENV_PATH, load_env
+from .gemini import get_model
+
+load_env()  # so the settings below can come from .env
+
+# Opt-in cross-session batching for arun(): turns arriving within this many ms
+# share one Gemini request. Saves requests-per-minute quota at the cost of some latency.
+BATCH_WINDOW_MS = float(os.getenv("GEMINI_BATCH_WINDOW_MS", "0"))
+BATCH_MAX_PROMPTS = int(os.getenv("GEMINI_BATCH_MAX", "8"))
+_scheduler: Optional[BatchScheduler] = None
+
+# Messages kept in SimpleAgent.history (older ones are dropped)
+HISTORY_LIMIT = 40
+
+# Process-wide LRU of replies keyed by the exact context sent to Gemini, so
+# repeated prompts ("hello", "what can you do") skip the API call
+RESPONSE_CACHE_SIZE = 512
+_response_cache: "OrderedDict[bytes, str]" = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+# Attempts per turn when Gemini reports a quota (429) error
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 2  # seconds
+
+async def close_scheduler():
+    """Stop the shared batch scheduler, if one was started (app shutdown)"""
+    global _scheduler
+    if _scheduler is not None:
+        await _scheduler.close()
+        _scheduler = None
+
+def _context_key(contents) -> bytes:
+    """Hash the Gemini contents of a turn into a compact cache key"""
+    return hashlib.blake2b(orjson.dumps(list(contents)), digest_size=16).digest()
+
+def _cached_reply(key: bytes) -> Optional[str]:
+    with _response_cache_lock:
+        reply = _response_cache.get(key)
+        if reply is not None:
+            _response_cache.move_to_end(key)
+        return reply
+
+def _cache_reply(key: bytes, reply: str):
+    with _response_cache_lock:
+        _response_cache[key] = reply
+        _response_cache.move_to_end(key)
+        while len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
 
 class SimpleAgent:
+    # Many agents can be alive at once (one per session); no per-instance __dict__
+    __slots__ = ("model", "session_id", "max_history", "history", "_contents")
+    
     def __init__(self, session_id: str = None):
         """Initialize the agent with Gemini configuration"""
-        # Get absolute path to .env file
-        env_path = pathlib.Path(os.path.dirname(os.path.dirname(__file__))) / '.env'
-        if not env_path.exists():
-            raise ValueError(f"Could not find .env file at {env_path}")
-            
-        # Load environment variables
-        load_dotenv(dotenv_path=env_path)
+        # Load environment variables (parsed once per process)
+        if not load_env() and not ENV_PATH.exists():
+            raise ValueError(f"Could not find .env file at {ENV_PATH}")
         
         # Get and validate API key with more detailed error handling
         api_key = os.getenv("GOOGLE_API_KEY")
         if not api_key:
             raise ValueError(
-                f"GOOGLE_API_KEY environment variable is not set after loading from {env_path}.\n"
+                f"GOOGLE_API_KEY environment variable is not set after loading from {ENV_PATH}.\n"
                 f"Please ensure the .env file contains: GOOGLE_API_KEY=your_api_key_here"
             )
         
         try:
-            # Configure the Gemini API
-            generativeai.configure(api_key=api_key)
-            
-            # Initialize the model with the new gemini-2.0-flash model
-            self.model = generativeai.GenerativeModel('gemini-2.0-flash')
+            # Shared gemini-2.0-flash model (configured once per API key)
+            self.model = get_model(api_key)
             
         except Exception as e:
             raise Exception(f"Failed to initialize Gemini API: {str(e)}")
         
-        # Initialize conversation history
-        self.history: List[Dict[str, str]] = []
-        
         # Store session ID for tracking
         self.session_id = session_id
         
         # Maximum history length to maintain context
         self.max_history = 10
+        
+        # Conversation history for display, bounded so long sessions don't grow forever
+        self.history: Deque[Dict[str, str]] = deque(maxlen=HISTORY_LIMIT)
+        
+        # Recent conversation already in Gemini's {"role", "parts"} shape, trimmed as it grows
+        self._contents: Deque[Dict[str, Any]] = deque(maxlen=self.max_history)
     
     def _handle_quota_error(self, error_msg: str) -> str:
         """Handle quota exceeded errors with helpful information"""
@@ -61,54 +112,91 @@ class SimpleAgent:
             )
         return f"API Error: {error_msg}"
     
-    def run(self, user_input: str) -> str:
-        """Process user input and return a response"""
-        # Add user message to history
+    def _start_turn(self, user_input: str) -> Tuple[bytes, Optional[str]]:
+        """Record the user's message; return the turn's cache key and any cached reply"""
         self.history.append({"role": "user", "content": user_input})
+        self._contents.append({"role": "user", "parts": [user_input]})
         
-        max_retries = 3
-        base_delay = 2  # seconds
+        # Identical context seen before - reuse the reply without calling Gemini
+        cache_key = _context_key(self._contents)
+        cached = _cached_reply(cache_key)
+        if cached is not None:
+            self.history.append({"role": "assistant", "content": cached})
+            self._contents.append({"role": "model", "parts": [cached]})
+        return cache_key, cached
+    
+    def _finish_turn(self, cache_key: bytes, response_text: str) -> str:
+        """Record and cache Gemini's reply"""
+        self.history.append({"role": "assistant", "content": response_text})
+        self._contents.append({"role": "model", "parts": [response_text]})
+        _cache_reply(cache_key, response_text)
+        return response_text
+    
+    def _retry_delay(self, error_msg: str, attempt: int) -> Optional[float]:
+        """Backoff before the next attempt, or None once retries are used up; raises for non-quota errors"""
+        if "429" not in error_msg or "quota" not in error_msg.lower():
+            raise Exception(f"Error communicating with Gemini: {error_msg}\nAPI Key status: {'Set' if os.getenv('GOOGLE_API_KEY') else 'Not Set'}")
+        if attempt < MAX_RETRIES - 1:
+            # Exponential backoff with jitter
+            return RETRY_BASE_DELAY * (2 ** attempt) + random.uniform(0, 1)
+        return None
+    
+    def run(self, user_input: str) -> str:
+        """Process user input and return a response"""
+        cache_key, cached = self._start_turn(user_input)
+        if cached is not None:
+            return cached
         
-        for attempt in range(max_retries):
+        for attempt in range(MAX_RETRIES):
             try:
-                # Create chat using history for context
-                chat = self.model.start_chat(history=[
-                    {"role": msg["role"], "parts": [msg["content"]]} 
-                    for msg in self.history[-self.max_history:]
-                ])
-                
-                # Get response from the model
-                response = chat.send_message(user_input)
-                response_text = response.text
-                
-                # Add assistant response to history
-                self.history.append({"role": "assistant", "content": response_text})
-                
-                return response_text
-                
+                # Send the recent conversation (ending with this turn) in one call
+                response = self.model.generate_content(list(self._contents))
+                return self._finish_turn(cache_key, response.text)
             except Exception as e:
-                error_msg = str(e)
-                
-                # Check if it's a quota error
-                if "429" in error_msg and "quota" in error_msg.lower():
-                    if attempt < max_retries - 1:
-                        # Calculate delay with exponential backoff and jitter
-                        delay = base_delay * (2 ** attempt) + random.uniform(0, 1)
-                        time.sleep(delay)
-                        continue
-                    else:
-                        # Final attempt failed, return helpful error message
-                        return self._handle_quota_error(error_msg)
+                delay = self._retry_delay(str(e), attempt)
+                if delay is None:
+                    return self._handle_quota_error(str(e))
+                time.sleep(delay)
+    
+    async def arun(self, user_input: str) -> str:
+        """Async variant of run using the SDK's native async client"""
+        cache_key, cached = self._start_turn(user_input)
+        if cached is not None:
+            return cached
+        
+        for attempt in range(MAX_RETRIES):
+            try:
+                if BATCH_WINDOW_MS > 0:
+                    response_text = await self._batched_generate()
                 else:
-                    # Non-quota error, raise immediately
-                    raise Exception(f"Error communicating with Gemini: {error_msg}\nAPI Key status: {'Set' if os.getenv('GOOGLE_API_KEY') else 'Not Set'}")
+                    response = await self.model.generate_content_async(list(self._contents))
+                    response_text = response.text
+                return self._finish_turn(cache_key, response_text)
+            except Exception as e:
+                delay = self._retry_delay(str(e), attempt)
+                if delay is None:
+                    return self._handle_quota_error(str(e))
+                await asyncio.sleep(delay)
+    
+    async def _batched_generate(self) -> str:
+        """Send this turn through the shared batch scheduler as a plain-text transcript"""
+        global _scheduler
+        if _scheduler is None:
+            _scheduler = BatchScheduler(self.model, window_ms=BATCH_WINDOW_MS, max_batch=BATCH_MAX_PROMPTS)
         
-        # This should never be reached, but just in case
-        return "An unexpected error occurred. Please try again."
+        recent = list(self._contents)
+        if len(recent) == 1:
+            prompt = recent[0]["parts"][0]
+        else:
+            transcript = "\n".join(
+                f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['parts'][0]}" for msg in recent[:-1]
+            )
+            prompt = f"Conversation so far:\n{transcript}\n\nReply to the user's latest message: {recent[-1]['parts'][0]}"
+        return await _scheduler.submit(prompt)
     
     def get_history(self) -> List[Dict[str, str]]:
         """Return the conversation history"""
-        return self.history
+        return list(self.history)
 
 def main():
     # Initialize the agent
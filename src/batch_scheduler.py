@@ -0,0 +1,124 @@
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Batched answers come back as "[1] ...\n[2] ..."; split on the markers at line starts
+_ANSWER_MARKER = re.compile(r"^\s*\[(\d+)\]\s*", re.MULTILINE)
+
+BATCH_INSTRUCTIONS = (
+    "Answer each of the following independent requests separately. "
+    "Start each answer on a new line prefixed with its number in square brackets, "
+    "e.g. [1], and do not mix information between requests.\n\n"
+)
+
+class BatchScheduler:
+    """Coalesce prompts submitted within a short window into one position-indexed Gemini call"""
+
+    def __init__(self, model, window_ms: float = 20, max_batch: int = 8):
+        self.model = model
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # The loop only keeps weak references to tasks; hold dispatches until they finish
+        self._inflight: Set[asyncio.Task] = set()
+
+    async def submit(self, prompt: str) -> str:
+        """Queue a prompt and wait for its answer"""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((prompt, future))
+        return await future
+
+    async def _run(self):
+        """Collect up to max_batch prompts per window and dispatch them together"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            try:
+                while len(batch) < self.max_batch:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                # Stopped mid-window: release the prompts collected so far
+                for _, future in batch:
+                    future.cancel()
+                raise
+            # Dispatch without blocking collection of the next window
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def close(self):
+        """Stop collecting prompts, cancel queued ones and wait for in-flight dispatches"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        while self._queue is not None and not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            future.cancel()
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    async def _dispatch(self, batch: List[Tuple[str, asyncio.Future]]):
+        prompts = [prompt for prompt, _ in batch]
+        try:
+            if len(prompts) == 1:
+                answers = [await self._generate(prompts[0])]
+            else:
+                answers = self._split_answers(await self._generate(self._combine(prompts)), len(prompts))
+                if answers is None:
+                    # The model didn't keep the numbering - answer each prompt on its own
+                    logger.warning("Could not split batched response, retrying %d prompts individually", len(prompts))
+                    answers = await asyncio.gather(*(self._generate(prompt) for prompt in prompts))
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        except BaseException:
+            # Cancelled mid-call (e.g. shutdown): don't leave callers waiting forever
+            for _, future in batch:
+                if not future.done():
+                    future.cancel()
+            raise
+
+        for (_, future), answer in zip(batch, answers):
+            if not future.done():
+                future.set_result(answer)
+
+    async def _generate(self, prompt: str) -> str:
+        response = await self.model.generate_content_async(prompt)
+        return response.text
+
+    @staticmethod
+    def _combine(prompts: List[str]) -> str:
+        numbered = "\n\n".join(f"[{i}] {prompt}" for i, prompt in enumerate(prompts, 1))
+        return BATCH_INSTRUCTIONS + numbered
+
+    @staticmethod
+    def _split_answers(text: str, count: int) -> Optional[List[str]]:
+        """Map "[i] answer" blocks back to prompt positions; None if any is missing"""
+        parts = _ANSWER_MARKER.split(text)
+        answers: Dict[int, str] = {}
+        for number, answer in zip(parts[1::2], parts[2::2]):
+            answers.setdefault(int(number), answer.strip())
+        if any(not answers.get(i) for i in range(1, count + 1)):
+            return None
+        return [answers[i] for i in range(1, count + 1)]
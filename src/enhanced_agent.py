@@ -1,26 +1,87 @@
-from typing import List, Dict, Any, Optional
+from typing import AsyncIterator, Callable, List, Dict, Any, Optional, Tuple
+import asyncio
 import os
 import json
+import logging
 import time
 import random
-from datetime import datetime
+import re
+import threading
+import uuid
+import orjson
+from datetime import datetime, timedelta
 from google import generativeai
-from dotenv import load_dotenv
-import pathlib
+from google.api_core import exceptions as google_exceptions
 
+from .env import load_env
+from .gemini import get_model
 from .utils.prompt_manager import PromptManager, PromptConfig
-from .utils.memory_manager import MongoMemoryManager
+from .utils.memory_manager import get_memory_manager
+
+logger = logging.getLogger(__name__)
+
+# Explicit context caching needs a newer google-generativeai than the pinned one
+try:
+    from google.generativeai import caching
+    caching_available = True
+except ImportError:
+    caching = None
+    caching_available = False
+
+CACHED_MODEL_NAME = "models/gemini-2.0-flash-001"  # caching requires a versioned model
+PROMPT_CACHE_TTL = timedelta(hours=1)
+
+# Attempts per Gemini call when it reports a quota/rate limit error
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 2  # seconds
+BUSY_REPLY = "I'm currently experiencing high demand. Please try again in a few moments. This helps me provide the best service to everyone."
+
+# Response keywords for _analyze_response: one alternation with a named group per
+# category, so a single finditer pass collects every category present. Plain
+# substring matches (no word boundaries). "code" words also count as programming.
+_RESPONSE_KEYWORDS = re.compile(
+    "(?P<code>code|programming)"
+    "|(?P<programming>function|variable|syntax)"
+    "|(?P<data_analysis>data|analysis|statistics|chart|graph)"
+    "|(?P<explanation>explain|definition|meaning|concept)"
+    "|(?P<tutorial>how|steps|process|method)"
+    "|(?P<followup>would you like|do you want|need more|specific|clarify|additional|more details)",
+    re.IGNORECASE
+)
+_TOPIC_ORDER = ("programming", "data_analysis", "explanation", "tutorial")
+
+# Question word in the user input picks the lead suggestions (how > what > why)
+_QUESTION_WORD = re.compile("(?P<how>how)|(?P<what>what)|(?P<why>why)", re.IGNORECASE)
+_QUESTION_SUGGESTIONS = {
+    "how": ("Would you like more details about this process?",
+            "Do you need examples to illustrate this?"),
+    "what": ("Would you like to see some examples?",
+             "Should I explain any specific part in more detail?"),
+    "why": ("Would you like to explore alternative approaches?",
+            "Do you want to understand the underlying principles?"),
+}
+_CODE_SUGGESTIONS = ("Would you like me to explain this code?",
+                     "Do you need help with implementation?")
+_GENERIC_SUGGESTIONS = ("Is there anything specific you'd like me to clarify?",
+                        "Would you like me to explain any part in more detail?",
+                        "Do you have any follow-up questions about this topic?")
+
+# System prefix -> model bound to its server-side cache (None if it couldn't be cached).
+# Shared by all agents since the prefix only depends on the prompt config.
+_cached_models: Dict[str, Any] = {}
+_cached_models_lock = threading.Lock()
 
 class EnhancedAgent:
     """Enhanced AI Agent with MongoDB memory, guardrails, and structured prompting"""
     
+    # One agent per live session; slots keep each instance small
+    __slots__ = ("model", "session_id", "user_id", "prompt_manager", "memory_manager", "context")
+    
     def __init__(self, session_id: Optional[str] = None, user_id: str = "anonymous"):
         """Initialize enhanced agent with all advanced features"""
         
-        # Load environment variables
-        env_path = pathlib.Path(os.path.dirname(os.path.dirname(__file__))) / '.env'
-        if env_path.exists():
-            load_dotenv(dotenv_path=env_path)
+        # Load environment variables (parsed once per process)
+        load_env()
         
         # Initialize Gemini API
         api_key = os.getenv("GOOGLE_API_KEY")
@@ -31,19 +92,20 @@ class EnhancedAgent:
             )
         
         try:
-            generativeai.configure(api_key=api_key)
-            self.model = generativeai.GenerativeModel('gemini-2.0-flash')
-            print("✅ Gemini API initialized successfully")
+            self.model = get_model(api_key)
+            logger.debug("Gemini API initialized successfully")
         except Exception as e:
             raise Exception(f"Failed to initialize Gemini API: {str(e)}")
         
         # Initialize session info
-        self.session_id = session_id or f"session_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+        self.session_id = session_id or f"session_{uuid.uuid4().hex}"
         self.user_id = user_id
         
         # Initialize enhanced components
-        self.prompt_manager = PromptManager(PromptConfig())
-        self.memory_manager = MongoMemoryManager()
+        # Opt-in LLM summaries of older turns (one extra Gemini call per summary)
+        summary_model = self.model if os.getenv("GEMINI_LLM_SUMMARY", "0") == "1" else None
+        self.prompt_manager = PromptManager(PromptConfig(), summary_model=summary_model)
+        self.memory_manager = get_memory_manager()  # shared by every agent in the process
         
         # Load existing conversation history from MongoDB
         self._load_conversation_history()
@@ -60,11 +122,12 @@ class EnhancedAgent:
             }
         }
         
-        print(f"🚀 Enhanced Agent initialized for user: {self.user_id}, session: {self.session_id}")
-        if self.memory_manager.is_connected():
-            print("✅ MongoDB connected - persistent memory active")
-        else:
-            print("⚠️ MongoDB not connected - using memory fallback")
+        # Built once per session, so keep it out of the default log output
+        logger.debug(
+            "Enhanced Agent initialized for user: %s, session: %s (%s)",
+            self.user_id, self.session_id,
+            "persistent memory" if self.memory_manager.is_connected() else "memory fallback"
+        )
     
     def _load_conversation_history(self):
         """Load conversation history from MongoDB"""
@@ -76,189 +139,363 @@ class EnhancedAgent:
             self.prompt_manager.conversation_history = history
             
             if history:
-                print(f"📚 Loaded {len(history)} messages from conversation history")
+                logger.debug("Loaded %d messages from conversation history", len(history))
             
         except Exception as e:
-            print(f"⚠️ Could not load conversation history: {str(e)}")
+            logger.warning("Could not load conversation history: %s", e)
             self.prompt_manager.conversation_history = []
     
     def run(self, user_input: str, format_type: str = "markdown") -> Dict[str, Any]:
         """Process user input with full enhancement pipeline"""
         
-        start_time = time.time()
+        start_time = time.perf_counter()
         
         try:
             # Step 1: Build enhanced prompt with guardrails
-            print(f"🔍 Processing user input: {user_input[:50]}...")
-            
-            prompt_result = self.prompt_manager.build_prompt(
-                user_input=user_input,
-                format_type=format_type,
-                context=self.context
-            )
-            
-            # Check for input validation errors
+            prompt_result = self._build_turn_prompt(user_input, format_type)
             if prompt_result.get("error"):
-                error_response = {
-                    "response": {
-                        "content": f"I can't process that request: {prompt_result['message']}",
-                        "format": format_type,
-                        "confidence": 0.0
-                    },
-                    "metadata": {
-                        "error": True,
-                        "error_type": "input_validation",
-                        "timestamp": datetime.now().isoformat(),
-                        "processing_time": time.time() - start_time,
-                        "guardrails_triggered": True
-                    },
-                    "follow_up": {
-                        "suggestions": prompt_result.get("suggestions", [
-                            "Please rephrase your question",
-                            "Try asking something different",
-                            "Make sure your message follows our guidelines"
-                        ]),
-                        "clarifications_needed": True
-                    }
-                }
-                
-                # Still save the interaction for learning purposes
-                self._save_interaction(
-                    user_input, 
-                    error_response["response"]["content"],
-                    {"error": True, "error_type": "input_validation"}
-                )
-                
-                return error_response
+                return self._reject_input(user_input, format_type, prompt_result, start_time)
             
             # Step 2: Generate AI response using enhanced prompt
-            enhanced_prompt = prompt_result["prompt"]
-            warnings = prompt_result.get("warnings", [])
-            
-            print("🧠 Generating AI response...")
-            ai_response = self._generate_response(enhanced_prompt)
-            
-            # Step 3: Validate AI response
-            output_validation = self.prompt_manager.validate_ai_response(ai_response)
-            if not output_validation["is_valid"]:
-                print("⚠️ AI response failed validation, using filtered content")
-                ai_response = output_validation["filtered_content"]
+            logger.debug("Generating AI response")
+            ai_response = self._generate_response(
+                prompt_result["prompt"],
+                prefix=prompt_result.get("prefix"),
+                delta=prompt_result.get("delta")
+            )
             
-            # Step 4: Parse structured response (if JSON format requested)
-            processing_time = time.time() - start_time
+            return self._finish_turn(user_input, format_type, prompt_result, ai_response, start_time)
             
-            if format_type == "json":
-                try:
-                    structured_response = json.loads(ai_response)
-                    # Ensure the response has the correct structure
-                    if not isinstance(structured_response, dict) or "response" not in structured_response:
-                        raise json.JSONDecodeError("Invalid response structure", ai_response, 0)
-                        
-                except json.JSONDecodeError:
-                    print("⚠️ Malformed JSON response, creating structured fallback")
-                    structured_response = self._create_structured_fallback(ai_response, format_type, warnings, processing_time)
-            else:
-                # For markdown/text responses, create structured format
-                structured_response = self._create_structured_fallback(ai_response, format_type, warnings, processing_time)
+        except Exception as e:
+            return self._processing_error(e, format_type, start_time)
+    
+    async def arun(self, user_input: str, format_type: str = "markdown", executor=None) -> Dict[str, Any]:
+        """Async run: awaits Gemini natively; the MongoDB save runs on executor (default pool if None) in the background"""
+        
+        start_time = time.perf_counter()
+        
+        try:
+            prompt_result = self._build_turn_prompt(user_input, format_type)
+            if prompt_result.get("error"):
+                return self._reject_input(
+                    user_input, format_type, prompt_result, start_time, save=self._background_saver(executor)
+                )
             
-            # Step 5: Add metadata and follow-up suggestions
-            structured_response["metadata"].update({
-                "timestamp": datetime.now().isoformat(),
-                "processing_time": processing_time,
-                "warnings": warnings,
-                "guardrails_active": True,
-                "memory_persistent": self.memory_manager.is_connected(),
-                "session_id": self.session_id,
-                "user_id": self.user_id
-            })
+            logger.debug("Generating AI response")
+            ai_response = await self._agenerate_response(
+                prompt_result["prompt"],
+                prefix=prompt_result.get("prefix"),
+                delta=prompt_result.get("delta"),
+                executor=executor
+            )
             
-            # Add intelligent follow-up suggestions
-            if not structured_response.get("follow_up", {}).get("suggestions"):
-                structured_response["follow_up"]["suggestions"] = self._generate_followup_suggestions(user_input, ai_response)
+            return self._finish_turn(
+                user_input, format_type, prompt_result, ai_response, start_time, save=self._background_saver(executor)
+            )
             
-            # Step 6: Save to persistent memory
-            try:
-                self._save_interaction(
-                    user_input, 
-                    structured_response["response"]["content"],
-                    {
-                        "format_type": format_type,
-                        "confidence": structured_response["response"].get("confidence", 0.8),
-                        "warnings": warnings,
-                        "processing_time": processing_time
-                    }
+        except Exception as e:
+            return self._processing_error(e, format_type, start_time)
+    
+    async def astream(self, user_input: str, format_type: str = "markdown", executor=None) -> AsyncIterator[Dict[str, Any]]:
+        """Stream a turn: yields {"type": "token", "text"} chunks as Gemini produces them,
+        then {"type": "final", "response"} with the validated structured response.
+        
+        Tokens are sent before output guardrails run, so clients should replace the
+        streamed text with the final response content.
+        """
+        start_time = time.perf_counter()
+        
+        try:
+            prompt_result = self._build_turn_prompt(user_input, format_type)
+            if prompt_result.get("error"):
+                rejected = self._reject_input(
+                    user_input, format_type, prompt_result, start_time, save=self._background_saver(executor)
                 )
-            except Exception as save_error:
-                print(f"⚠️ Could not save to persistent memory: {str(save_error)}")
+                yield {"type": "final", "response": rejected}
+                return
             
-            # Step 7: Update prompt manager history
-            self.prompt_manager.add_to_history(user_input, structured_response["response"]["content"])
-            
-            print(f"✅ Response generated successfully in {processing_time:.2f}s")
-            return structured_response
+            logger.debug("Streaming AI response")
+            chunks = []
+            async for text in self._astream_response(prompt_result["prompt"]):
+                chunks.append(text)
+                yield {"type": "token", "text": text}
             
+            result = self._finish_turn(
+                user_input, format_type, prompt_result, "".join(chunks), start_time, save=self._background_saver(executor)
+            )
         except Exception as e:
-            # Enhanced error handling
-            processing_time = time.time() - start_time
-            error_response = {
-                "response": {
-                    "content": f"I apologize, but I encountered an error while processing your request: {str(e)}",
-                    "format": format_type,
-                    "confidence": 0.0
-                },
-                "metadata": {
-                    "error": True,
-                    "error_type": "processing_error",
-                    "error_details": str(e),
-                    "timestamp": datetime.now().isoformat(),
-                    "processing_time": processing_time,
-                    "session_id": self.session_id
-                },
-                "follow_up": {
-                    "suggestions": [
-                        "Please try your question again",
-                        "Try rephrasing your request",
-                        "Contact support if the issue persists"
-                    ],
-                    "clarifications_needed": True
+            result = self._processing_error(e, format_type, start_time)
+        
+        yield {"type": "final", "response": result}
+    
+    def _build_turn_prompt(self, user_input: str, format_type: str) -> Dict[str, Any]:
+        """Build the prompt for a turn, running input guardrails"""
+        logger.debug("Processing user input: %.50s", user_input)
+        
+        return self.prompt_manager.build_prompt(
+            user_input=user_input,
+            format_type=format_type,
+            context=self.context
+        )
+    
+    def _background_saver(self, executor=None) -> Callable[[str, str, Dict[str, Any]], None]:
+        """Return a save function that writes the turn on executor without waiting for MongoDB"""
+        loop = asyncio.get_running_loop()
+        
+        def save(user_input: str, ai_response: str, metadata: Dict[str, Any]):
+            # _save_interaction logs its own failures, so nothing awaits the future
+            loop.run_in_executor(executor, self._save_interaction, user_input, ai_response, metadata)
+        
+        return save
+    
+    def _reject_input(self, user_input: str, format_type: str, prompt_result: Dict[str, Any], start_time: float, save: Optional[Callable] = None) -> Dict[str, Any]:
+        """Build (and record) the response for input that failed validation"""
+        error_response = {
+            "response": {
+                "content": f"I can't process that request: {prompt_result['message']}",
+                "format": format_type,
+                "confidence": 0.0
+            },
+            "metadata": {
+                "error": True,
+                "error_type": "input_validation",
+                "timestamp": datetime.now().isoformat(),
+                "processing_time": time.perf_counter() - start_time,
+                "guardrails_triggered": True
+            },
+            "follow_up": {
+                "suggestions": prompt_result.get("suggestions", [
+                    "Please rephrase your question",
+                    "Try asking something different",
+                    "Make sure your message follows our guidelines"
+                ]),
+                "clarifications_needed": True
+            }
+        }
+        
+        # Still save the interaction for learning purposes
+        (save or self._save_interaction)(
+            user_input, 
+            error_response["response"]["content"],
+            {"error": True, "error_type": "input_validation"}
+        )
+        
+        return error_response
+    
+    def _finish_turn(self, user_input: str, format_type: str, prompt_result: Dict[str, Any], ai_response: str, start_time: float, save: Optional[Callable] = None) -> Dict[str, Any]:
+        """Validate, structure, persist (via save, default: synchronous) and record a generated response"""
+        warnings = prompt_result.get("warnings", [])
+        
+        # Step 3: Validate AI response
+        output_validation = self.prompt_manager.validate_ai_response(ai_response)
+        if not output_validation["is_valid"]:
+            logger.warning("AI response failed validation, using filtered content")
+            ai_response = output_validation["filtered_content"]
+        
+        analysis = self._analyze_response(user_input, ai_response)
+        
+        # Step 4: Parse structured response (if JSON format requested)
+        processing_time = time.perf_counter() - start_time
+        
+        if format_type == "json":
+            try:
+                structured_response = orjson.loads(ai_response)
+                # Ensure the response has the correct structure
+                if not isinstance(structured_response, dict) or "response" not in structured_response:
+                    raise json.JSONDecodeError("Invalid response structure", ai_response, 0)
+                    
+            except json.JSONDecodeError:  # orjson.JSONDecodeError subclasses it
+                logger.debug("Malformed JSON response, creating structured fallback")
+                structured_response = self._create_structured_fallback(ai_response, format_type, warnings, processing_time, analysis)
+        else:
+            # For markdown/text responses, create structured format
+            structured_response = self._create_structured_fallback(ai_response, format_type, warnings, processing_time, analysis)
+        
+        # Step 5: Add metadata and follow-up suggestions
+        structured_response["metadata"].update({
+            "timestamp": datetime.now().isoformat(),
+            "processing_time": processing_time,
+            "warnings": warnings,
+            "guardrails_active": True,
+            "memory_persistent": self.memory_manager.is_connected(),
+            "session_id": self.session_id,
+            "user_id": self.user_id
+        })
+        
+        # Add intelligent follow-up suggestions
+        if not structured_response.get("follow_up", {}).get("suggestions"):
+            structured_response["follow_up"]["suggestions"] = analysis[2]
+        
+        # Step 6: Save to persistent memory
+        try:
+            (save or self._save_interaction)(
+                user_input, 
+                structured_response["response"]["content"],
+                {
+                    "format_type": format_type,
+                    "confidence": structured_response["response"].get("confidence", 0.8),
+                    "warnings": warnings,
+                    "processing_time": processing_time
                 }
+            )
+        except Exception as save_error:
+            logger.warning("Could not save to persistent memory: %s", save_error)
+        
+        # Step 7: Update prompt manager history
+        self.prompt_manager.add_to_history(user_input, structured_response["response"]["content"])
+        
+        logger.debug("Response generated in %.2fs", processing_time)
+        return structured_response
+    
+    def _processing_error(self, e: Exception, format_type: str, start_time: float) -> Dict[str, Any]:
+        """Build the response for an unexpected error during a turn"""
+        # Enhanced error handling
+        processing_time = time.perf_counter() - start_time
+        error_response = {
+            "response": {
+                "content": f"I apologize, but I encountered an error while processing your request: {str(e)}",
+                "format": format_type,
+                "confidence": 0.0
+            },
+            "metadata": {
+                "error": True,
+                "error_type": "processing_error",
+                "error_details": str(e),
+                "timestamp": datetime.now().isoformat(),
+                "processing_time": processing_time,
+                "session_id": self.session_id
+            },
+            "follow_up": {
+                "suggestions": [
+                    "Please try your question again",
+                    "Try rephrasing your request",
+                    "Contact support if the issue persists"
+                ],
+                "clarifications_needed": True
             }
-            
-            print(f"❌ Error processing request: {str(e)}")
-            return error_response
+        }
+        
+        logger.error("Error processing request: %s", e)
+        return error_response
+    
+    @staticmethod
+    def _model_for_prefix(prefix: str, stale: Any = None):
+        """Return a model bound to a server-side cache of prefix, or None if caching isn't possible.
+        
+        Pass the model whose cache expired as stale to recreate it; callers that
+        raced on the same expiry get the model the first one recreated.
+        """
+        if not caching_available:
+            return None
+        with _cached_models_lock:
+            if prefix in _cached_models and (stale is None or _cached_models[prefix] is not stale):
+                return _cached_models[prefix]
+            try:
+                cache = caching.CachedContent.create(
+                    model=CACHED_MODEL_NAME,
+                    system_instruction=prefix,
+                    ttl=PROMPT_CACHE_TTL
+                )
+                model = generativeai.GenerativeModel.from_cached_content(cached_content=cache)
+                logger.info("Cached system prompt on the Gemini side")
+            except Exception as e:
+                # e.g. prefix below the minimum cacheable size - send full prompts instead
+                logger.warning("Prompt caching unavailable, sending full prompts: %s", e)
+                model = None
+            _cached_models[prefix] = model
+            return model
     
-    def _generate_response(self, prompt: str) -> str:
+    @staticmethod
+    def _retry_delay(error_msg: str, attempt: int) -> Optional[float]:
+        """Backoff before the next attempt, or None once retries are used up; raises for non-rate-limit errors"""
+        if "429" not in error_msg and "quota" not in error_msg.lower() and "rate" not in error_msg.lower():
+            raise Exception(f"Gemini API error: {error_msg}")
+        if attempt < MAX_RETRIES - 1:
+            # Exponential backoff with jitter
+            delay = RETRY_BASE_DELAY * (2 ** attempt) + random.uniform(0, 1)
+            logger.warning("Rate limit hit, retrying in %.1fs (attempt %d/%d)", delay, attempt + 1, MAX_RETRIES)
+            return delay
+        return None
+    
+    def _generate_response(self, prompt: str, prefix: Optional[str] = None, delta: Optional[str] = None) -> str:
         """Generate response from Gemini with retry logic"""
-        max_retries = 3
-        base_delay = 2  # seconds
+        # With a cached prefix only the per-turn delta is sent
+        cached_model = self._model_for_prefix(prefix) if prefix and delta else None
         
-        for attempt in range(max_retries):
+        for attempt in range(MAX_RETRIES):
             try:
-                # Use the enhanced prompt with the model
-                response = self.model.generate_content(prompt)
+                if cached_model is not None:
+                    try:
+                        response = cached_model.generate_content(delta)
+                    except google_exceptions.NotFound:
+                        # Cache expired server-side - recreate it once, else fall back
+                        cached_model = self._model_for_prefix(prefix, stale=cached_model)
+                        if cached_model is not None:
+                            response = cached_model.generate_content(delta)
+                        else:
+                            response = self.model.generate_content(prompt)
+                else:
+                    # Use the enhanced prompt with the model
+                    response = self.model.generate_content(prompt)
                 return response.text
-                
             except Exception as e:
-                error_msg = str(e)
-                
-                # Check if it's a quota/rate limit error
-                if "429" in error_msg or "quota" in error_msg.lower() or "rate" in error_msg.lower():
-                    if attempt < max_retries - 1:
-                        # Exponential backoff with jitter
-                        delay = base_delay * (2 ** attempt) + random.uniform(0, 1)
-                        print(f"⏳ Rate limit hit, retrying in {delay:.1f}s (attempt {attempt + 1}/{max_retries})")
-                        time.sleep(delay)
-                        continue
-                    else:
-                        return "I'm currently experiencing high demand. Please try again in a few moments. This helps me provide the best service to everyone."
+                delay = self._retry_delay(str(e), attempt)
+                if delay is None:
+                    return BUSY_REPLY
+                time.sleep(delay)
+    
+    async def _agenerate_response(self, prompt: str, prefix: Optional[str] = None, delta: Optional[str] = None, executor=None) -> str:
+        """Async counterpart of _generate_response using the SDK's native async client"""
+        cached_model = None
+        if prefix and delta and caching_available:
+            # Creating the cache is a blocking call, but only happens once per prefix
+            loop = asyncio.get_running_loop()
+            cached_model = await loop.run_in_executor(executor, self._model_for_prefix, prefix)
+        
+        for attempt in range(MAX_RETRIES):
+            try:
+                if cached_model is not None:
+                    try:
+                        response = await cached_model.generate_content_async(delta)
+                    except google_exceptions.NotFound:
+                        # Cache expired server-side - recreate it once (off the event loop), else fall back
+                        cached_model = await loop.run_in_executor(
+                            executor, self._model_for_prefix, prefix, cached_model
+                        )
+                        if cached_model is not None:
+                            response = await cached_model.generate_content_async(delta)
+                        else:
+                            response = await self.model.generate_content_async(prompt)
                 else:
-                    # Non-quota error, raise immediately
-                    raise Exception(f"Gemini API error: {error_msg}")
+                    response = await self.model.generate_content_async(prompt)
+                return response.text
+            except Exception as e:
+                delay = self._retry_delay(str(e), attempt)
+                if delay is None:
+                    return BUSY_REPLY
+                await asyncio.sleep(delay)
+    
+    async def _astream_response(self, prompt: str) -> AsyncIterator[str]:
+        """Yield Gemini's reply as it streams in, retrying rate limits on the first chunk"""
+        for attempt in range(MAX_RETRIES):
+            try:
+                # Awaiting the call receives the first chunk; later failures can't be retried
+                # since earlier chunks have already been sent to the client
+                response = await self.model.generate_content_async(prompt, stream=True)
+                break
+            except Exception as e:
+                delay = self._retry_delay(str(e), attempt)
+                if delay is None:
+                    yield BUSY_REPLY
+                    return
+                await asyncio.sleep(delay)
         
-        # This should never be reached, but just in case
-        return "I encountered an unexpected error. Please try again."
+        async for chunk in response:
+            text = chunk.text
+            if text:
+                yield text
     
-    def _create_structured_fallback(self, ai_response: str, format_type: str, warnings: List[str], processing_time: float) -> Dict[str, Any]:
+    def _create_structured_fallback(self, ai_response: str, format_type: str, warnings: List[str], processing_time: float, analysis: Tuple[str, bool, List[str]]) -> Dict[str, Any]:
         """Create structured response format for non-JSON responses"""
         return {
             "response": {
@@ -268,8 +505,8 @@ class EnhancedAgent:
             },
             "metadata": {
                 "sources": [],
-                "topic": self._detect_topic(ai_response),
-                "requires_followup": self._needs_followup(ai_response),
+                "topic": analysis[0],
+                "requires_followup": analysis[1],
                 "warnings": warnings,
                 "processing_time": processing_time,
                 "response_length": len(ai_response)
@@ -280,67 +517,29 @@ class EnhancedAgent:
             }
         }
     
-    def _detect_topic(self, response: str) -> str:
-        """Simple topic detection based on keywords"""
-        response_lower = response.lower()
-        
-        if any(word in response_lower for word in ["code", "programming", "function", "variable", "syntax"]):
-            return "programming"
-        elif any(word in response_lower for word in ["data", "analysis", "statistics", "chart", "graph"]):
-            return "data_analysis"
-        elif any(word in response_lower for word in ["explain", "definition", "meaning", "concept"]):
-            return "explanation"
-        elif any(word in response_lower for word in ["how", "steps", "process", "method"]):
-            return "tutorial"
-        else:
-            return "general"
-    
-    def _needs_followup(self, response: str) -> bool:
-        """Determine if response might need follow-up questions"""
-        followup_indicators = [
-            "would you like",
-            "do you want",
-            "need more",
-            "specific",
-            "clarify",
-            "additional",
-            "more details"
-        ]
-        
-        return any(indicator in response.lower() for indicator in followup_indicators)
-    
-    def _generate_followup_suggestions(self, user_input: str, ai_response: str) -> List[str]:
-        """Generate contextual follow-up suggestions"""
-        suggestions = []
-        
-        # Analyze user input for context
-        user_lower = user_input.lower()
-        response_lower = ai_response.lower()
-        
-        if "how" in user_lower:
-            suggestions.append("Would you like more details about this process?")
-            suggestions.append("Do you need examples to illustrate this?")
-        elif "what" in user_lower:
-            suggestions.append("Would you like to see some examples?")
-            suggestions.append("Should I explain any specific part in more detail?")
-        elif "why" in user_lower:
-            suggestions.append("Would you like to explore alternative approaches?")
-            suggestions.append("Do you want to understand the underlying principles?")
+    def _analyze_response(self, user_input: str, ai_response: str) -> Tuple[str, bool, List[str]]:
+        """Detect topic, follow-up need and suggestions in one pass over the response"""
+        found = {match.lastgroup for match in _RESPONSE_KEYWORDS.finditer(ai_response)}
+        if "code" in found:
+            found.add("programming")
+        
+        # Simple topic detection based on keywords
+        topic = next((topic for topic in _TOPIC_ORDER if topic in found), "general")
+        
+        # Contextual follow-up suggestions, led by the kind of question asked
+        asked = {match.lastgroup for match in _QUESTION_WORD.finditer(user_input)}
+        question = next((word for word in _QUESTION_SUGGESTIONS if word in asked), None)
+        suggestions = list(_QUESTION_SUGGESTIONS[question]) if question else []
         
         # Add suggestions based on response content
-        if "code" in response_lower or "programming" in response_lower:
-            suggestions.append("Would you like me to explain this code?")
-            suggestions.append("Do you need help with implementation?")
+        if "code" in found:
+            suggestions.extend(_CODE_SUGGESTIONS)
         
         # Generic helpful suggestions if none specific
-        if len(suggestions) == 0:
-            suggestions = [
-                "Is there anything specific you'd like me to clarify?",
-                "Would you like me to explain any part in more detail?",
-                "Do you have any follow-up questions about this topic?"
-            ]
-        
-        return suggestions[:3]  # Limit to 3 suggestions
+        if not suggestions:
+            suggestions = list(_GENERIC_SUGGESTIONS)
+        
+        return topic, "followup" in found, suggestions[:3]  # Limit to 3 suggestions
     
     def _save_interaction(self, user_input: str, ai_response: str, metadata: Dict[str, Any]):
         """Save conversation turn to persistent storage"""
@@ -353,7 +552,7 @@ class EnhancedAgent:
                 metadata=metadata
             )
         except Exception as e:
-            print(f"⚠️ Failed to save interaction: {str(e)}")
+            logger.warning("Failed to save interaction: %s", e)
     
     def get_conversation_summary(self) -> Dict[str, Any]:
         """Get conversation summary and statistics"""
@@ -381,7 +580,7 @@ class EnhancedAgent:
     def clear_conversation(self):
         """Clear current conversation context"""
         self.prompt_manager.clear_history()
-        print("🧹 Session context cleared (persistent history preserved)")
+        logger.debug("Session context cleared (persistent history preserved)")
     
     def get_full_history(self, limit: int = 50) -> List[Dict[str, str]]:
         """Get full conversation history from MongoDB"""
@@ -391,13 +590,13 @@ class EnhancedAgent:
                 limit=limit
             )
         except Exception as e:
-            print(f"⚠️ Could not retrieve full history: {str(e)}")
+            logger.warning("Could not retrieve full history: %s", e)
             return self.prompt_manager.conversation_history
     
     def update_preferences(self, preferences: Dict[str, Any]):
         """Update user preferences"""
         self.context["user_preferences"].update(preferences)
-        print(f"✅ Updated user preferences: {preferences}")
+        logger.debug("Updated user preferences: %s", preferences)
     
     def get_database_stats(self) -> Dict[str, Any]:
         """Get database statistics"""
@@ -406,11 +605,3 @@ class EnhancedAgent:
     def cleanup_old_data(self, days_old: int = 30) -> int:
         """Clean up old conversation data"""
         return self.memory_manager.cleanup_old_sessions(days_old)
-    
-    def __del__(self):
-        """Cleanup when agent is destroyed"""
-        try:
-            if hasattr(self, 'memory_manager') and self.memory_manager:
-                self.memory_manager.close_connection()
-        except:
-            pass  # Ignore cleanup errors
@@ -0,0 +1,21 @@
+from functools import lru_cache
+from typing import Dict, Optional
+import os
+import pathlib
+from dotenv import dotenv_values
+
+# Project-level .env shared by both agents and the memory manager
+ENV_PATH = pathlib.Path(os.path.dirname(os.path.dirname(__file__))) / '.env'
+
+@lru_cache(maxsize=1)
+def load_env() -> Dict[str, Optional[str]]:
+    """Load the project .env into os.environ once per process and return its values"""
+    if not ENV_PATH.exists():
+        return {}
+    
+    values = dotenv_values(ENV_PATH)
+    # Same precedence as load_dotenv(): real environment variables win
+    for key, value in values.items():
+        if value is not None:
+            os.environ.setdefault(key, value)
+    return values
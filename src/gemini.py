@@ -0,0 +1,10 @@
+from functools import lru_cache
+from google import generativeai
+
+MODEL_NAME = 'gemini-2.0-flash'
+
+@lru_cache(maxsize=4)
+def get_model(api_key: str, model_name: str = MODEL_NAME) -> generativeai.GenerativeModel:
+    """Configure the Gemini API and return a model instance shared by every agent in the process"""
+    generativeai.configure(api_key=api_key)
+    return generativeai.GenerativeModel(model_name)
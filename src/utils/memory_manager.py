@@ -1,14 +1,78 @@
 from typing import Dict, List, Optional, Any
 import json
+import atexit
+import heapq
+import logging
 import os
+import sys
+import threading
 from datetime import datetime, timedelta
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
 import uuid
-from pymongo import MongoClient, ASCENDING, DESCENDING
+import time
+from collections import OrderedDict, defaultdict
+from pymongo import MongoClient, ASCENDING, DESCENDING, InsertOne, ReadPreference, UpdateOne
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
-from dotenv import load_dotenv
 
-@dataclass
+from ..env import load_env
+
+# Wire compression for conversation payloads (mostly text); zstd/snappy need
+# their optional packages, zlib is always available
+_COMPRESSORS = ["zlib"]
+try:
+    import zstandard  # noqa: F401
+    _COMPRESSORS.insert(0, "zstd")
+except ImportError:
+    pass
+try:
+    import snappy  # noqa: F401
+    _COMPRESSORS.insert(-1, "snappy")
+except ImportError:
+    pass
+
+logger = logging.getLogger(__name__)
+
+# Conversation documents are stored with short field names (less disk, RAM and
+# index space per turn); everything outside MongoMemoryManager sees the long names
+CONVERSATION_FIELDS = {
+    "id": "i",
+    "session_id": "s",
+    "user_id": "u",
+    "user_message": "um",
+    "ai_response": "ar",
+    "timestamp": "t",
+    "metadata": "m"
+}
+
+# Compound index behind every per-session conversation query; hinted explicitly
+# (once it is confirmed to exist) so plan-cache churn can't pick the u or t index instead
+SESSION_TIME_INDEX = [("s", ASCENDING), ("t", DESCENDING)]
+USER_ACTIVITY_INDEX = [("user_id", ASCENDING), ("last_activity", DESCENDING)]
+
+# MongoDB expires conversation turns and sessions this many days after their
+# timestamp / last activity (TTL indexes, reaped in the background by the server)
+RETENTION_DAYS = int(os.getenv("MONGODB_RETENTION_DAYS", "30"))
+
+# Completed one-off data migrations are recorded in this collection
+META_COLLECTION = "meta"
+MIGRATIONS_DOC_ID = "migrations"
+
+# Connected saves are buffered and sent as one bulk_write per collection once
+# this many turns are queued, or this many seconds after the first one
+WRITE_BUFFER_SIZE = 32
+WRITE_FLUSH_INTERVAL = 0.1
+
+# Recent get_conversation_history / get_session_summary results per manager,
+# dropped when the session gets a new turn
+READ_CACHE_SIZE = 256
+READ_CACHE_TTL = 5.0  # seconds
+
+def _shrink(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Long -> short field names for a conversation document being written"""
+    return {CONVERSATION_FIELDS.get(key, key): value for key, value in doc.items()}
+
+# Python 3.10+ gives turns __slots__ (no per-instance __dict__); 3.8/3.9 keep plain dataclasses
+@dataclass(**({"slots": True} if sys.version_info >= (3, 10) else {}))
 class ConversationTurn:
     id: str
     session_id: str
@@ -19,28 +83,59 @@ class ConversationTurn:
     metadata: Optional[Dict[str, Any]] = None
     
     def to_dict(self) -> Dict:
-        data = asdict(self)
-        data['timestamp'] = self.timestamp.isoformat()
-        return data
+        # Flat record: build the dict directly instead of asdict()'s recursive copy.
+        # timestamp stays a datetime (stored as a native BSON date)
+        return {
+            "id": self.id,
+            "session_id": self.session_id,
+            "user_id": self.user_id,
+            "user_message": self.user_message,
+            "ai_response": self.ai_response,
+            "timestamp": self.timestamp,
+            "metadata": self.metadata
+        }
     
     @classmethod
     def from_dict(cls, data: Dict) -> 'ConversationTurn':
-        data['timestamp'] = datetime.fromisoformat(data['timestamp'])
+        if isinstance(data['timestamp'], str):
+            data['timestamp'] = datetime.fromisoformat(data['timestamp'])
         return cls(**data)
 
 class MongoMemoryManager:
     """MongoDB-based persistent conversation memory manager"""
     
-    def __init__(self, connection_string: Optional[str] = None, database_name: str = "ocean_ai"):
-        """Initialize MongoDB connection"""
+    def __init__(self, connection_string: Optional[str] = None, database_name: str = "ocean_ai",
+                 secondary_reads: bool = True):
+        """Initialize MongoDB connection (secondary_reads: serve reads from replica-set secondaries when available)"""
         # Load environment variables if not already loaded
-        load_dotenv()
+        load_env()
         
         # Get connection string from environment or parameter
         if connection_string is None:
             connection_string = os.getenv("MONGODB_CONNECTION_STRING", "mongodb://localhost:27017/")
         
         self.database_name = database_name
+        
+        # Index hints, set once _resolve_hints has seen the indexes exist
+        self._session_time_hint: Dict[str, Any] = {}
+        self._user_activity_hint: Optional[List] = None
+        
+        # Write buffer for save_conversation_turn (see WRITE_BUFFER_SIZE)
+        self._write_lock = threading.Lock()
+        self._write_buf: List[Dict[str, Any]] = []
+        self._session_buf: Dict[str, Dict[str, Any]] = {}
+        self._flush_timer: Optional[threading.Timer] = None
+        
+        # (kind, session_id, ...) -> (stored_at, result), see READ_CACHE_SIZE
+        self._read_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._read_cache_lock = threading.Lock()
+        self._read_generation = 0  # bumped by every invalidation
+        
+        # In-memory storage: used when MongoDB is down, and for turns whose write failed
+        self._memory_conversations = []
+        self._memory_sessions = {}
+        # The same turns per session_id, in save order (avoids scanning every turn)
+        self._memory_by_session: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
         self.connection_string = connection_string
         
         try:
@@ -49,7 +144,12 @@ class MongoMemoryManager:
                 connection_string,
                 serverSelectionTimeoutMS=5000,  # 5 second timeout
                 connectTimeoutMS=10000,         # 10 second connection timeout
-                maxPoolSize=50,                 # Maximum number of connections
+                maxPoolSize=200,                # Maximum number of connections
+                minPoolSize=10,                 # Warm connections kept open
+                maxIdleTimeMS=300_000,          # Reap connections idle for 5 minutes
+                maxConnecting=4,                # Avoid connection storms on startup
+                waitQueueTimeoutMS=2000,        # Fail fast when the pool is exhausted
+                compressors=",".join(_COMPRESSORS),
                 retryWrites=True               # Retry writes on failure
             )
             
@@ -61,26 +161,36 @@ class MongoMemoryManager:
             self.conversations = self.db.conversations
             self.sessions = self.db.sessions
             
-            # Create indexes for better performance
+            # Read-only handles; writes always go through the primary collections above
+            read_preference = ReadPreference.SECONDARY_PREFERRED if secondary_reads else ReadPreference.PRIMARY
+            self._read_conversations = self.conversations.with_options(read_preference=read_preference)
+            self._read_sessions = self.sessions.with_options(read_preference=read_preference)
+            
+            # Bring documents written with long field names over, then index
+            self._migrate_field_names()
+            self._migrate_timestamps()
             self._create_indexes()
+            self._resolve_hints()
             
-            print(f"✅ MongoDB connected successfully to {database_name}")
+            logger.info("MongoDB connected successfully to %s", database_name)
             
         except (ConnectionFailure, ServerSelectionTimeoutError) as e:
             error_msg = str(e)
             if "actively refused" in error_msg or "10061" in error_msg:
-                print("⚠️ MongoDB not running (connection refused).")
+                logger.warning("MongoDB not running (connection refused)")
             else:
-                print(f"❌ MongoDB connection failed: {error_msg}")
-            print("🔧 Falling back to in-memory storage...")
+                logger.error("MongoDB connection failed: %s", error_msg)
+            logger.warning("Falling back to in-memory storage")
             self.client = None
             self.db = None
             self.conversations = None
             self.sessions = None
-            
-            # Fallback in-memory storage
-            self._memory_conversations = []
-            self._memory_sessions = {}
+            self._read_conversations = None
+            self._read_sessions = None
+        
+        # Connection state is fixed after __init__: resolve the storage branch once
+        self._connected = self.client is not None
+        self._store_turn = self._queue_turn if self._connected else self._store_turn_in_memory
     
     def _create_indexes(self):
         """Create MongoDB indexes for better query performance"""
@@ -90,25 +200,97 @@ class MongoMemoryManager:
         try:
             # Only create indexes if collections are available
             if self.conversations is not None and self.sessions is not None:
-                # Conversations collection indexes
-                self.conversations.create_index([("session_id", ASCENDING)])
-                self.conversations.create_index([("user_id", ASCENDING)])
-                self.conversations.create_index([("timestamp", DESCENDING)])
-                self.conversations.create_index([("session_id", ASCENDING), ("timestamp", DESCENDING)])
+                # Conversations collection indexes (short field names, see CONVERSATION_FIELDS).
+                # (s, t desc) serves session lookups, counts and first/last-turn sorts.
+                self.conversations.create_index(SESSION_TIME_INDEX)
+                self.conversations.create_index([("u", ASCENDING)])
+                self._ensure_ttl_index(self.conversations, "t")
                 
-                # Sessions collection indexes
-                self.sessions.create_index([("user_id", ASCENDING)])
-                self.sessions.create_index([("last_activity", DESCENDING)])
+                # Sessions collection indexes: (user_id, last_activity desc) matches
+                # get_user_sessions' equality + sort in one index scan
+                self.sessions.create_index(USER_ACTIVITY_INDEX)
                 self.sessions.create_index([("session_id", ASCENDING)], unique=True)
+                self._ensure_ttl_index(self.sessions, "last_activity")
+                
+                # Prefixes of the compound indexes above and the pre-TTL timestamp
+                # index, created by earlier versions
+                for collection, index_name in ((self.conversations, "s_1"),
+                                               (self.conversations, "t_-1"),
+                                               (self.sessions, "user_id_1"),
+                                               (self.sessions, "last_activity_-1")):
+                    if index_name in collection.index_information():
+                        collection.drop_index(index_name)
             
-            print("📊 MongoDB indexes created successfully")
+            logger.info("MongoDB indexes created successfully")
             
         except Exception as e:
-            print(f"⚠️ Warning: Could not create indexes: {str(e)}")
+            logger.warning("Could not create indexes: %s", e)
+    
+    def _resolve_hints(self):
+        """Hint the compound indexes only if they exist (their creation can fail, e.g. permissions)"""
+        try:
+            if any(info["key"] == SESSION_TIME_INDEX for info in self.conversations.index_information().values()):
+                self._session_time_hint = {"hint": SESSION_TIME_INDEX}
+            if any(info["key"] == USER_ACTIVITY_INDEX for info in self.sessions.index_information().values()):
+                self._user_activity_hint = USER_ACTIVITY_INDEX
+        except Exception as e:
+            logger.warning("Could not check indexes, queries run without hints: %s", e)
+    
+    def _ensure_ttl_index(self, collection, field: str):
+        """Create the RETENTION_DAYS TTL index on field, or update its expiry if it changed"""
+        expire_after = RETENTION_DAYS * 86400
+        existing = collection.index_information().get(f"{field}_1")
+        if existing is None:
+            collection.create_index([(field, ASCENDING)], expireAfterSeconds=expire_after)
+        elif existing.get("expireAfterSeconds") != expire_after:
+            self.db.command("collMod", collection.name,
+                            index={"keyPattern": {field: 1}, "expireAfterSeconds": expire_after})
+    
+    def _migrate_field_names(self):
+        """Rename long conversation fields written by older versions (no-op once done)"""
+        try:
+            # Once done, the marker saves every process start an unindexed scan for old names
+            if self.db[META_COLLECTION].find_one({"_id": MIGRATIONS_DOC_ID, "short_field_names": True}) is not None:
+                return
+            
+            if self.conversations.find_one({"session_id": {"$exists": True}}, projection={"_id": 1}) is not None:
+                result = self.conversations.update_many(
+                    {"session_id": {"$exists": True}},
+                    {"$rename": CONVERSATION_FIELDS}
+                )
+                
+                # Indexes on the old names would only index missing fields from now on
+                for index_name in ("session_id_1", "user_id_1", "timestamp_-1", "session_id_1_timestamp_-1"):
+                    try:
+                        self.conversations.drop_index(index_name)
+                    except Exception:
+                        pass
+                
+                logger.info("Migrated %d conversation turns to short field names", result.modified_count)
+            
+            self.db[META_COLLECTION].update_one(
+                {"_id": MIGRATIONS_DOC_ID}, {"$set": {"short_field_names": True}}, upsert=True
+            )
+            
+        except Exception as e:
+            logger.warning("Could not migrate conversation field names: %s", e)
+    
+    def _migrate_timestamps(self):
+        """Convert ISO-string timestamps written by older versions to BSON dates (no-op once done)"""
+        try:
+            result = self.conversations.update_many(
+                {"t": {"$type": "string"}},
+                [{"$set": {"t": {"$dateFromString": {"dateString": "$t"}}}}]
+            )
+            if result.modified_count:
+                logger.info("Converted %d conversation timestamps to BSON dates", result.modified_count)
+            
+        except Exception as e:
+            logger.warning("Could not convert conversation timestamps: %s", e)
     
     def is_connected(self) -> bool:
         """Check if MongoDB is connected"""
-        return self.client is not None
+        return self._connected
     
     def save_conversation_turn(self, 
                              session_id: str,
@@ -117,7 +299,7 @@ class MongoMemoryManager:
                              ai_response: str,
                              metadata: Optional[Dict[str, Any]] = None) -> str:
         """Save a conversation turn to database"""
-        turn_id = str(uuid.uuid4())
+        turn_id = uuid.uuid4().hex  # 32 chars, no hyphens (matches session ids)
         turn = ConversationTurn(
             id=turn_id,
             session_id=session_id,
@@ -128,85 +310,169 @@ class MongoMemoryManager:
             metadata=metadata or {}
         )
         
-        if self.is_connected() and self.conversations is not None:
-            try:
-                # Save to MongoDB
-                self.conversations.insert_one(turn.to_dict())
-                
-                # Update or create session record
-                session_data = {
-                    "session_id": session_id,
-                    "user_id": user_id,
-                    "last_activity": datetime.utcnow(),
-                    "session_metadata": {}
-                }
-                
-                if self.sessions is not None:
-                    self.sessions.update_one(
+        # Invalidate once the turn is queued: a read that slips in before this either
+        # flushes the turn itself or fetched before it and is not cached (generation moved)
+        turn_id = self._store_turn(turn)
+        self._invalidate_reads(session_id)
+        return turn_id
+    
+    def _queue_turn(self, turn: ConversationTurn) -> str:
+        """Buffer a turn for the next bulk_write (connected)"""
+        # Update or create session record
+        session_data = {
+            "session_id": turn.session_id,
+            "user_id": turn.user_id,
+            "last_activity": datetime.utcnow(),
+            "session_metadata": {}
+        }
+        
+        # Queue the write; it goes out with the next bulk_write
+        with self._write_lock:
+            self._write_buf.append(turn.to_dict())
+            self._session_buf[turn.session_id] = session_data
+            flush_now = len(self._write_buf) >= WRITE_BUFFER_SIZE
+            if not flush_now and self._flush_timer is None:
+                self._flush_timer = threading.Timer(WRITE_FLUSH_INTERVAL, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+        
+        if flush_now:
+            self.flush()
+        return turn.id
+    
+    def _store_turn_in_memory(self, turn: ConversationTurn) -> str:
+        """Keep a turn in the in-memory store (MongoDB unavailable)"""
+        turn_data = turn.to_dict()
+        self._memory_conversations.append(turn_data)
+        self._memory_by_session[turn.session_id].append(turn_data)
+        self._memory_sessions[turn.session_id] = {
+            "session_id": turn.session_id,
+            "user_id": turn.user_id,
+            "last_activity": datetime.utcnow(),
+            "created_at": datetime.utcnow(),
+            "session_metadata": {}
+        }
+        return turn.id
+    
+    def _cached_read(self, key: tuple):
+        with self._read_cache_lock:
+            entry = self._read_cache.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > READ_CACHE_TTL:
+                del self._read_cache[key]
+                return None
+            self._read_cache.move_to_end(key)
+            return entry[1]
+    
+    def _cache_read(self, key: tuple, result, generation: int):
+        with self._read_cache_lock:
+            if generation != self._read_generation:
+                return  # invalidated while this result was being fetched - may be stale
+            self._read_cache[key] = (time.monotonic(), result)
+            self._read_cache.move_to_end(key)
+            while len(self._read_cache) > READ_CACHE_SIZE:
+                self._read_cache.popitem(last=False)
+    
+    def _invalidate_reads(self, session_id: Optional[str] = None):
+        """Drop cached reads for a session (all sessions if None)"""
+        with self._read_cache_lock:
+            self._read_generation += 1
+            if session_id is None:
+                self._read_cache.clear()
+                return
+            for key in [key for key in self._read_cache if key[1] == session_id]:
+                del self._read_cache[key]
+    
+    def flush(self):
+        """Write buffered conversation turns and session updates to MongoDB"""
+        with self._write_lock:
+            turns, self._write_buf = self._write_buf, []
+            session_updates, self._session_buf = self._session_buf, {}
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+        
+        if not turns or self.conversations is None:
+            return
+        
+        try:
+            # Unordered bulk writes: one round trip per collection for the whole batch
+            self.conversations.bulk_write([InsertOne(_shrink(turn)) for turn in turns], ordered=False)
+            
+            if self.sessions is not None:
+                self.sessions.bulk_write([
+                    UpdateOne(
                         {"session_id": session_id},
                         {
                             "$set": session_data,
-                            "$setOnInsert": {"created_at": datetime.utcnow()}
+                            "$setOnInsert": {"created_at": session_data["last_activity"]}
                         },
                         upsert=True
                     )
+                    for session_id, session_data in session_updates.items()
+                ], ordered=False)
                 
-                return turn_id
-                
-            except Exception as e:
-                print(f"⚠️ MongoDB save failed, using memory fallback: {str(e)}")
-                # Fallback to memory
-                self._memory_conversations.append(turn.to_dict())
-                self._memory_sessions[session_id] = session_data
-                return turn_id
-        else:
-            # Use memory storage
-            self._memory_conversations.append(turn.to_dict())
-            self._memory_sessions[session_id] = {
-                "session_id": session_id,
-                "user_id": user_id,
-                "last_activity": datetime.utcnow(),
-                "created_at": datetime.utcnow(),
-                "session_metadata": {}
-            }
-            return turn_id
+        except Exception as e:
+            logger.warning("MongoDB save failed, using memory fallback: %s", e)
+            # Fallback to memory
+            self._memory_conversations.extend(turns)
+            for turn in turns:
+                self._memory_by_session[turn["session_id"]].append(turn)
+            self._memory_sessions.update(session_updates)
     
     def get_conversation_history(self, 
                                session_id: str, 
                                limit: int = 20,
                                offset: int = 0) -> List[Dict[str, str]]:
         """Retrieve conversation history for a session"""
+        key = ("history", session_id, limit, offset)
+        cached = self._cached_read(key)
+        if cached is None:
+            generation = self._read_generation
+            cached = self._fetch_conversation_history(session_id, limit, offset)
+            self._cache_read(key, cached, generation)
+        return list(cached)
+    
+    def _fetch_conversation_history(self, session_id: str, limit: int, offset: int) -> List[Dict[str, str]]:
+        self.flush()  # reads see turns still in the write buffer
         
-        if self.is_connected() and self.conversations is not None:
+        if self._connected:
             try:
-                # Query MongoDB
-                cursor = self.conversations.find(
-                    {"session_id": session_id}
-                ).sort("timestamp", DESCENDING).skip(offset).limit(limit)
+                # Newest `limit` turns sliced and re-sorted oldest-first on the server,
+                # projected down to the two fields the history needs
+                cursor = self._read_conversations.aggregate([
+                    {"$match": {"s": session_id}},
+                    {"$sort": {"t": DESCENDING}},
+                    {"$skip": offset},
+                    {"$limit": limit},
+                    {"$sort": {"t": ASCENDING}},
+                    {"$project": {"_id": 0, "um": 1, "ar": 1}}
+                ], batchSize=max(limit, 1), **self._session_time_hint)
                 
-                conversations = list(cursor)
+                history = []
+                for conv in cursor:
+                    history.extend([
+                        {"role": "user", "content": conv["um"]},
+                        {"role": "assistant", "content": conv["ar"]}
+                    ])
+                return history
                 
             except Exception as e:
-                print(f"⚠️ MongoDB query failed, using memory fallback: {str(e)}")
+                logger.warning("MongoDB query failed, using memory fallback: %s", e)
                 # Fallback to memory
-                conversations = [
-                    conv for conv in self._memory_conversations 
-                    if conv["session_id"] == session_id
-                ]
-                conversations = sorted(conversations, key=lambda x: x["timestamp"], reverse=True)
-                conversations = conversations[offset:offset+limit]
+                conversations = self._memory_by_session.get(session_id, [])
+                end = len(conversations) - offset
+                conversations = conversations[max(end - limit, 0):max(end, 0)]
         else:
             # Use memory storage
-            conversations = [
-                conv for conv in self._memory_conversations 
-                if conv["session_id"] == session_id
-            ]
-            conversations = sorted(conversations, key=lambda x: x["timestamp"], reverse=True)
-            conversations = conversations[offset:offset+limit]
+            conversations = self._memory_by_session.get(session_id, [])
+            end = len(conversations) - offset
+            conversations = conversations[max(end - limit, 0):max(end, 0)]
         
-        # Convert to conversation format (reverse order for chronological)
+        # Convert to conversation format (already chronological)
         history = []
-        for conv in reversed(conversations):
+        for conv in conversations:
             history.extend([
                 {"role": "user", "content": conv["user_message"]},
                 {"role": "assistant", "content": conv["ai_response"]}
@@ -216,43 +482,47 @@ class MongoMemoryManager:
     
     def get_session_summary(self, session_id: str) -> Dict[str, Any]:
         """Get summary statistics for a session"""
+        key = ("summary", session_id)
+        cached = self._cached_read(key)
+        if cached is None:
+            generation = self._read_generation
+            cached = self._fetch_session_summary(session_id)
+            self._cache_read(key, cached, generation)
+        return dict(cached)
+    
+    def _fetch_session_summary(self, session_id: str) -> Dict[str, Any]:
+        self.flush()
         
-        if self.is_connected() and self.conversations is not None and self.sessions is not None:
+        if self._connected:
             try:
-                # Count conversations
-                conversation_count = self.conversations.count_documents({"session_id": session_id})
+                # Count conversations and get first/last message timestamps in one pass;
+                # only s and t are read, so the (s, t) index covers it (no document fetches)
+                stats = next(self._read_conversations.aggregate([
+                    {"$match": {"s": session_id}},
+                    {"$project": {"_id": 0, "t": 1}},
+                    {"$group": {"_id": None, "n": {"$sum": 1}, "first": {"$min": "$t"}, "last": {"$max": "$t"}}}
+                ], **self._session_time_hint), None)
                 
-                # Get first and last message timestamps
-                first_conv = self.conversations.find_one(
-                    {"session_id": session_id},
-                    sort=[("timestamp", ASCENDING)]
-                )
-                
-                last_conv = self.conversations.find_one(
+                # Get session metadata
+                session_info = self._read_sessions.find_one(
                     {"session_id": session_id},
-                    sort=[("timestamp", DESCENDING)]
+                    projection={"_id": 0, "created_at": 1, "user_id": 1}
                 )
                 
-                # Get session metadata
-                session_info = self.sessions.find_one({"session_id": session_id})
-                
                 return {
                     "session_id": session_id,
-                    "turn_count": conversation_count,
-                    "first_message": first_conv["timestamp"] if first_conv else None,
-                    "last_message": last_conv["timestamp"] if last_conv else None,
+                    "turn_count": stats["n"] if stats else 0,
+                    "first_message": stats["first"] if stats else None,
+                    "last_message": stats["last"] if stats else None,
                     "created_at": session_info["created_at"] if session_info else None,
                     "user_id": session_info["user_id"] if session_info else "unknown",
                     "storage_type": "mongodb"
                 }
                 
             except Exception as e:
-                print(f"⚠️ MongoDB query failed, using memory fallback: {str(e)}")
+                logger.warning("MongoDB query failed, using memory fallback: %s", e)
                 # Fallback to memory
-                session_convs = [
-                    conv for conv in self._memory_conversations 
-                    if conv["session_id"] == session_id
-                ]
+                session_convs = self._memory_by_session.get(session_id)
                 
                 if session_convs:
                     timestamps = [conv["timestamp"] for conv in session_convs]
@@ -265,10 +535,7 @@ class MongoMemoryManager:
                     }
         else:
             # Use memory storage
-            session_convs = [
-                conv for conv in self._memory_conversations 
-                if conv["session_id"] == session_id
-            ]
+            session_convs = self._memory_by_session.get(session_id)
             
             if session_convs:
                 timestamps = [conv["timestamp"] for conv in session_convs]
@@ -288,25 +555,32 @@ class MongoMemoryManager:
     
     def get_user_sessions(self, user_id: str, limit: int = 10) -> List[Dict[str, Any]]:
         """Get all sessions for a user"""
+        self.flush()
         
-        if self.is_connected() and self.sessions is not None and self.conversations is not None:
+        if self._connected:
             try:
-                cursor = self.sessions.find(
-                    {"user_id": user_id}
-                ).sort("last_activity", DESCENDING).limit(limit)
+                user_sessions = list(self._read_sessions.find(
+                    {"user_id": user_id},
+                    projection={"_id": 0, "session_id": 1, "created_at": 1, "last_activity": 1, "session_metadata": 1}
+                ).sort("last_activity", DESCENDING).limit(limit).batch_size(limit).hint(self._user_activity_hint))
+                
+                # Count conversations for all of these sessions in one round trip
+                session_ids = [session["session_id"] for session in user_sessions]
+                conv_counts = {
+                    group["_id"]: group["c"]
+                    for group in self._read_conversations.aggregate([
+                        {"$match": {"s": {"$in": session_ids}}},
+                        {"$group": {"_id": "$s", "c": {"$sum": 1}}}
+                    ], batchSize=len(session_ids))
+                } if session_ids else {}
                 
                 sessions = []
-                for session in cursor:
-                    # Get conversation count for each session
-                    conv_count = self.conversations.count_documents(
-                        {"session_id": session["session_id"]}
-                    )
-                    
+                for session in user_sessions:
                     session_info = {
                         "session_id": session["session_id"],
                         "created_at": session.get("created_at"),
                         "last_activity": session["last_activity"],
-                        "conversation_count": conv_count,
+                        "conversation_count": conv_counts.get(session["session_id"], 0),
                         "metadata": session.get("session_metadata", {})
                     }
                     sessions.append(session_info)
@@ -314,7 +588,7 @@ class MongoMemoryManager:
                 return sessions
                 
             except Exception as e:
-                print(f"⚠️ MongoDB query failed: {str(e)}")
+                logger.warning("MongoDB query failed: %s", e)
                 return []
         else:
             # Use memory storage
@@ -325,10 +599,7 @@ class MongoMemoryManager:
             
             sessions = []
             for session in user_sessions:
-                conv_count = len([
-                    conv for conv in self._memory_conversations
-                    if conv["session_id"] == session["session_id"]
-                ])
+                conv_count = len(self._memory_by_session.get(session["session_id"], ()))
                 
                 sessions.append({
                     "session_id": session["session_id"],
@@ -337,18 +608,21 @@ class MongoMemoryManager:
                     "conversation_count": conv_count
                 })
             
-            return sorted(sessions, key=lambda x: x["last_activity"], reverse=True)[:limit]
+            # Top `limit` by activity without sorting every session
+            return heapq.nlargest(limit, sessions, key=lambda x: x["last_activity"])
     
     def cleanup_old_sessions(self, days_old: int = 30) -> int:
-        """Clean up sessions older than specified days"""
+        """Clean up sessions older than specified days (MongoDB also expires them after RETENTION_DAYS)"""
+        self.flush()
+        self._invalidate_reads()
         cutoff_date = datetime.utcnow() - timedelta(days=days_old)
         deleted_count = 0
         
-        if self.is_connected() and self.conversations is not None and self.sessions is not None:
+        if self._connected:
             try:
                 # Delete old conversations
                 conv_result = self.conversations.delete_many({
-                    "timestamp": {"$lt": cutoff_date}
+                    "t": {"$lt": cutoff_date}
                 })
                 
                 # Delete old sessions
@@ -357,19 +631,23 @@ class MongoMemoryManager:
                 })
                 
                 deleted_count = conv_result.deleted_count
-                print(f"🧹 Cleaned up {deleted_count} old conversation turns and {session_result.deleted_count} sessions")
+                logger.info("Cleaned up %d old conversation turns and %d sessions", deleted_count, session_result.deleted_count)
                 
             except Exception as e:
-                print(f"⚠️ Cleanup failed: {str(e)}")
+                logger.warning("Cleanup failed: %s", e)
         else:
             # Clean memory storage
             initial_count = len(self._memory_conversations)
             self._memory_conversations = [
                 conv for conv in self._memory_conversations
-                if datetime.fromisoformat(conv["timestamp"]) >= cutoff_date
+                if conv["timestamp"] >= cutoff_date
             ]
             deleted_count = initial_count - len(self._memory_conversations)
             
+            self._memory_by_session = defaultdict(list)
+            for conv in self._memory_conversations:
+                self._memory_by_session[conv["session_id"]].append(conv)
+            
             # Clean sessions
             self._memory_sessions = {
                 k: v for k, v in self._memory_sessions.items()
@@ -380,13 +658,14 @@ class MongoMemoryManager:
     
     def get_database_stats(self) -> Dict[str, Any]:
         """Get database statistics"""
-        if self.is_connected() and self.conversations is not None and self.sessions is not None and self.db is not None:
+        self.flush()
+        if self._connected:
             try:
                 stats = {
                     "connected": True,
                     "database": self.database_name,
-                    "total_conversations": self.conversations.estimated_document_count(),
-                    "total_sessions": self.sessions.estimated_document_count(),
+                    "total_conversations": self._read_conversations.estimated_document_count(),
+                    "total_sessions": self._read_sessions.estimated_document_count(),
                     "storage_type": "mongodb"
                 }
                 
@@ -416,15 +695,22 @@ class MongoMemoryManager:
     def close_connection(self):
         """Close MongoDB connection"""
         if self.client:
+            self.flush()
             self.client.close()
-            print("🔌 MongoDB connection closed")
+            logger.info("MongoDB connection closed")
 
 # Singleton instance for easy import
 _memory_manager_instance = None
+_memory_manager_lock = threading.Lock()
 
 def get_memory_manager() -> MongoMemoryManager:
-    """Get singleton memory manager instance"""
+    """Get singleton memory manager instance (one MongoClient pool per process)"""
     global _memory_manager_instance
     if _memory_manager_instance is None:
-        _memory_manager_instance = MongoMemoryManager()
+        with _memory_manager_lock:
+            if _memory_manager_instance is None:
+                manager = MongoMemoryManager()
+                # Drain buffered writes and close the pool on interpreter exit
+                atexit.register(manager.close_connection)
+                _memory_manager_instance = manager
     return _memory_manager_instance
@@ -1,17 +1,47 @@
-from typing import Dict, List, Optional, Any
+from typing import Deque, Dict, List, Optional, Any
+from collections import deque
+from bisect import bisect_right
+from itertools import islice
+import asyncio
 import json
+import logging
 import re
+import string
+import sys
+import threading
+import time
 from datetime import datetime
 from dataclasses import dataclass
 
+# Optional Aho-Corasick automaton for the literal guardrail keywords
+try:
+    import ahocorasick
+    ahocorasick_available = True
+except ImportError:
+    ahocorasick = None
+    ahocorasick_available = False
+
+# Optional Hyperscan (SIMD regex engine) for the guardrail scans
+try:
+    import hyperscan
+    hyperscan_available = True
+except ImportError:
+    hyperscan = None
+    hyperscan_available = False
+
+logger = logging.getLogger(__name__)
+
 @dataclass
 class PromptConfig:
     max_history: int = 10
-    summary_threshold: int = 8
     temperature: float = 0.7
     top_p: float = 0.95
     max_tokens: int = 4096
     
+    # LLM summaries of messages that fall out of the history window
+    summary_temperature: float = 0.3
+    summary_max_tokens: int = 250
+    
     # Guardrails
     safety_filters: Optional[Dict[str, bool]] = None
     allowed_topics: Optional[List[str]] = None
@@ -30,35 +60,252 @@ class PromptConfig:
         if self.restricted_topics is None:
             self.restricted_topics = ["illegal", "harmful", "inappropriate", "violence", "hate"]
 
+def _fuse(patterns: List[str]) -> "re.Pattern":
+    """Compile a category's patterns into one alternation, so the input is scanned once"""
+    return re.compile("|".join(f"(?:{p})" for p in patterns), re.IGNORECASE)
+
+def _terms_pattern(terms: List[str]) -> str:
+    """Whole-word alternation of literal terms"""
+    return r'\b(?:' + "|".join(re.escape(term) for term in terms) + r')\b'
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+# Batch scans join inputs with a newline: no guardrail pattern can match across one
+# ("." and the literal terms never match it, and \b treats it like the end of the text)
+_BATCH_SEPARATOR = "\n"
+
+def _text_starts(texts: List[str]) -> List[int]:
+    """Offset of each text in _BATCH_SEPARATOR.join(texts)"""
+    starts, offset = [], 0
+    for text in texts:
+        starts.append(offset)
+        offset += len(text) + 1
+    return starts
+
+def _mark_matches(pattern: "re.Pattern", joined: str, starts: List[int], hits: List[bool]):
+    """Flag every text of a joined batch that pattern matches in"""
+    for match in pattern.finditer(joined):
+        hits[bisect_right(starts, match.start()) - 1] = True
+
+class _KeywordMatcher:
+    """Whole-word keyword scan with one Aho-Corasick pass; non-literal patterns stay regex"""
+    
+    def __init__(self, terms: List[str], patterns: List[str]):
+        self.automaton = ahocorasick.Automaton()
+        for term in terms:
+            self.automaton.add_word(term, len(term))
+        self.automaton.make_automaton()
+        self.pattern = _fuse(patterns) if patterns else None
+    
+    def search(self, text: str, text_lower: Optional[str] = None) -> bool:
+        if text_lower is None:
+            text_lower = text.lower()
+        for end, length in self.automaton.iter(text_lower):
+            start = end - length + 1
+            # Same word boundaries as \b...\b around the term
+            if (start == 0 or not _is_word_char(text_lower[start - 1])) and \
+               (end + 1 == len(text_lower) or not _is_word_char(text_lower[end + 1])):
+                return True
+        return bool(self.pattern and self.pattern.search(text))
+    
+    def search_many(self, texts: List[str], texts_lower: List[str]) -> List[bool]:
+        hits = [False] * len(texts)
+        joined_lower = _BATCH_SEPARATOR.join(texts_lower)
+        starts = _text_starts(texts_lower)
+        last = len(joined_lower) - 1
+        for end, length in self.automaton.iter(joined_lower):
+            start = end - length + 1
+            if (start == 0 or not _is_word_char(joined_lower[start - 1])) and \
+               (end == last or not _is_word_char(joined_lower[end + 1])):
+                hits[bisect_right(starts, start) - 1] = True
+        if self.pattern:
+            _mark_matches(self.pattern, _BATCH_SEPARATOR.join(texts), _text_starts(texts), hits)
+        return hits
+
+class _PrefilteredRegex:
+    """Regex fallback: a plain substring check for the literal terms gates their regex"""
+    
+    def __init__(self, terms: List[str], patterns: List[str]):
+        self.terms = tuple(terms)
+        self.terms_pattern = _fuse([_terms_pattern(terms)])
+        self.pattern = _fuse(patterns) if patterns else None
+    
+    def search(self, text: str, text_lower: Optional[str] = None) -> bool:
+        # Benign text contains none of the terms, so the regex engine never runs for them
+        if text_lower is None:
+            text_lower = text.lower()
+        if any(term in text_lower for term in self.terms) and self.terms_pattern.search(text):
+            return True
+        return bool(self.pattern and self.pattern.search(text))
+    
+    def search_many(self, texts: List[str], texts_lower: List[str]) -> List[bool]:
+        hits = [False] * len(texts)
+        joined = _BATCH_SEPARATOR.join(texts)
+        starts = _text_starts(texts)
+        # One substring gate for the whole batch
+        joined_lower = _BATCH_SEPARATOR.join(texts_lower)
+        if any(term in joined_lower for term in self.terms):
+            _mark_matches(self.terms_pattern, joined, starts, hits)
+        if self.pattern:
+            _mark_matches(self.pattern, joined, starts, hits)
+        return hits
+
+# Hyperscan can miss a \b match that ends exactly at the end of the buffer, so scans get a
+# trailing space: no guardrail pattern ends with one, and \b sees it like the end of the text
+_SCAN_PADDING = b" "
+
+def _stop_scan(*args) -> bool:
+    return True  # first match is enough - stop the Hyperscan scan
+
+class _HyperscanMatcher:
+    """A category's patterns in one Hyperscan database, used for ASCII text"""
+    
+    def __init__(self, patterns: List[str], fallback):
+        # Hyperscan's \b is ASCII-only (UCP mode rejects it) and it has no back-references,
+        # so non-ASCII text goes to the fallback matcher and unsupported patterns stay regex
+        supported, unsupported = [], []
+        for pattern in patterns:
+            try:
+                hyperscan.Database().compile(expressions=[pattern.encode()], flags=hyperscan.HS_FLAG_CASELESS)
+                supported.append(pattern)
+            except hyperscan.error:
+                unsupported.append(pattern)
+        
+        self.database = hyperscan.Database()
+        self.database.compile(
+            expressions=[pattern.encode() for pattern in supported],
+            ids=list(range(len(supported))),
+            elements=len(supported),
+            flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH] * len(supported)
+        )
+        self.pattern = _fuse(unsupported) if unsupported else None
+        self.fallback = fallback
+        # Batch scans need every match, not just the first per pattern
+        self.batch_database = hyperscan.Database()
+        self.batch_database.compile(
+            expressions=[pattern.encode() for pattern in supported],
+            ids=list(range(len(supported))),
+            elements=len(supported),
+            flags=[hyperscan.HS_FLAG_CASELESS] * len(supported)
+        )
+        self._local = threading.local()  # scratch space can't be shared between threads
+    
+    def search(self, text: str, text_lower: Optional[str] = None) -> bool:
+        if not text.isascii():
+            return bool(self.fallback.search(text, text_lower))
+        
+        scratch = getattr(self._local, "scratch", None)
+        if scratch is None:
+            scratch = self._local.scratch = hyperscan.Scratch(self.database)
+        try:
+            self.database.scan(text.encode() + _SCAN_PADDING, match_event_handler=_stop_scan, scratch=scratch)
+        except hyperscan.ScanTerminated:
+            return True
+        return bool(self.pattern and self.pattern.search(text))
+    
+    def search_many(self, texts: List[str], texts_lower: List[str]) -> List[bool]:
+        hits = [False] * len(texts)
+        ascii_indices = [i for i, text in enumerate(texts) if text.isascii()]
+        if len(ascii_indices) < len(texts):
+            other = [i for i, text in enumerate(texts) if not text.isascii()]
+            for i, hit in zip(other, self.fallback.search_many([texts[i] for i in other],
+                                                               [texts_lower[i] for i in other])):
+                hits[i] = hit
+        if not ascii_indices:
+            return hits
+        
+        batch = [texts[i] for i in ascii_indices]
+        joined = _BATCH_SEPARATOR.join(batch)
+        starts = _text_starts(batch)
+        
+        def on_match(pattern_id, start, end, flags, context):
+            # end is one past the match (bytes == chars for ASCII)
+            hits[ascii_indices[bisect_right(starts, end - 1) - 1]] = True
+        
+        scratch = getattr(self._local, "batch_scratch", None)
+        if scratch is None:
+            scratch = self._local.batch_scratch = hyperscan.Scratch(self.batch_database)
+        self.batch_database.scan(joined.encode() + _SCAN_PADDING, match_event_handler=on_match, scratch=scratch)
+        if self.pattern:
+            batch_hits = [False] * len(batch)
+            _mark_matches(self.pattern, joined, starts, batch_hits)
+            for i, hit in zip(ascii_indices, batch_hits):
+                hits[i] = hits[i] or hit
+        return hits
+
+def _guardrail_matcher(terms: List[str], patterns: List[str] = ()):
+    """Matcher for one category: whole-word literal terms plus any non-literal regex patterns"""
+    if ahocorasick_available:
+        matcher = _KeywordMatcher(terms, list(patterns))
+    else:
+        matcher = _PrefilteredRegex(terms, list(patterns))
+    
+    if hyperscan_available:
+        return _HyperscanMatcher([_terms_pattern(terms), *patterns], fallback=matcher)
+    return matcher
+
+# Guardrail matchers, one per category (built once at import, case-insensitive)
+
+# Harmful content
+_HARMFUL_RE = _guardrail_matcher(
+    ["hack", "crack", "pirate", "illegal", "drugs", "violence",
+     "suicide", "bomb", "weapon", "attack", "terror",
+     "murder", "kill", "death", "poison"],
+    [r'\b(self.harm|hurt.yourself)\b']
+)
+
+# Spam - only extremely obvious spam
+_SPAM_RE = _guardrail_matcher(
+    ["buy now", "click here", "free money"],  # Obvious promotional
+    # Only very long repeated characters (20+). Bounded rather than {20,} so a match stops
+    # at the first long run instead of consuming all of it; linear time on any input
+    [r'(.)\1{20}']
+)
+
+# Off-topic (customize for your domain)
+_OFF_TOPIC_RE = _guardrail_matcher(["weather today", "sports scores", "celebrities", "gossip", "astrology"])
+
+# Profanity (basic set)
+_PROFANITY_RE = _guardrail_matcher(["fuck", "shit", "damn", "hell", "ass", "bitch"])
+
+# validate_input / validate_inputs messages
+HARMFUL_REASON = "Content violates safety guidelines. Please ask something else."
+SPAM_REASON = "Message appears to be spam or promotional content."
+PROFANITY_WARNING = "Please keep the conversation professional"
+OFF_TOPIC_WARNING = "This question might be outside my expertise area"
+TOO_SHORT_REASON = "Message is too short. Please provide more details."
+TOO_LONG_REASON = "Message is too long. Please break it into smaller parts."
+
+def _length_problem(text: str) -> str:
+    """Reason a message is too short or too long, or "" if its length is fine"""
+    # Only copy the text for strip() when it actually starts or ends with whitespace
+    if text[:1].isspace() or text[-1:].isspace():
+        if len(text.strip()) < 3:
+            return TOO_SHORT_REASON
+    elif len(text) < 3:
+        return TOO_SHORT_REASON
+    if len(text) > 5000:
+        return TOO_LONG_REASON
+    return ""
+
 class GuardrailsFilter:
     """Input/Output safety and topic filters"""
     
     def __init__(self, config: PromptConfig):
         self.config = config
         
-        # Harmful content patterns
-        self.harmful_patterns = [
-            r'\b(hack|crack|pirate|illegal|drugs|violence)\b',
-            r'\b(suicide|self.harm|hurt.yourself)\b',
-            r'\b(bomb|weapon|attack|terror)\b',
-            r'\b(murder|kill|death|poison)\b'
-        ]
-        
-        # Spam patterns - only extremely obvious spam
-        self.spam_patterns = [
-            r'(.)\1{20,}',  # Only very long repeated characters (20+)
-            r'\b(buy now|click here|free money)\b',  # Obvious promotional
-        ]
-        
-        # Off-topic patterns (customize for your domain)
-        self.off_topic_patterns = [
-            r'\b(weather today|sports scores|celebrities|gossip|astrology)\b'
-        ]
+        self.harmful_pattern = _HARMFUL_RE
+        self.spam_pattern = _SPAM_RE
+        self.off_topic_pattern = _OFF_TOPIC_RE
+        self.profanity_pattern = _PROFANITY_RE
         
-        # Profanity patterns (basic set)
-        self.profanity_patterns = [
-            r'\b(fuck|shit|damn|hell|ass|bitch)\b'
-        ]
+        # Which checks run, resolved once (an empty or missing safety_filters disables them all)
+        filters = config.safety_filters or {}
+        self.check_harmful = bool(filters) and filters.get("harmful_content", True)
+        self.check_spam = bool(filters) and filters.get("spam_detection", True)
+        self.check_profanity = bool(filters) and filters.get("profanity", True)
+        self.check_off_topic = bool(filters) and filters.get("off_topic", True)
     
     def validate_input(self, user_input: str) -> Dict[str, Any]:
         """Validate user input against guardrails"""
@@ -69,46 +316,75 @@ class GuardrailsFilter:
             "warnings": []
         }
         
+        # Length checks first: no point scanning a message that is rejected anyway
+        length_problem = _length_problem(user_input)
+        if length_problem:
+            result["is_valid"] = False
+            result["reason"] = length_problem
+            return result
+        
+        # Lowercased once and shared by every category's matcher
+        input_lower = user_input.lower()
+        
         # Check for harmful content
-        if self.config.safety_filters and self.config.safety_filters.get("harmful_content", True):
-            for pattern in self.harmful_patterns:
-                if re.search(pattern, user_input.lower()):
-                    result["is_valid"] = False
-                    result["reason"] = "Content violates safety guidelines. Please ask something else."
-                    return result
+        if self.check_harmful:
+            if self.harmful_pattern.search(user_input, input_lower):
+                result["is_valid"] = False
+                result["reason"] = HARMFUL_REASON
+                return result
         
         # Check for spam
-        if self.config.safety_filters and self.config.safety_filters.get("spam_detection", True):
-            for pattern in self.spam_patterns:
-                if re.search(pattern, user_input, re.IGNORECASE):
-                    result["is_valid"] = False
-                    result["reason"] = "Message appears to be spam or promotional content."
-                    return result
+        if self.check_spam:
+            if self.spam_pattern.search(user_input, input_lower):
+                result["is_valid"] = False
+                result["reason"] = SPAM_REASON
+                return result
         
         # Check for profanity (warning only, not blocking)
-        if self.config.safety_filters and self.config.safety_filters.get("profanity", True):
-            for pattern in self.profanity_patterns:
-                if re.search(pattern, user_input.lower()):
-                    result["warnings"].append("Please keep the conversation professional")
+        if self.check_profanity:
+            if self.profanity_pattern.search(user_input, input_lower):
+                result["warnings"].append(PROFANITY_WARNING)
         
         # Check for off-topic (warning only)
-        if self.config.safety_filters and self.config.safety_filters.get("off_topic", True):
-            for pattern in self.off_topic_patterns:
-                if re.search(pattern, user_input.lower()):
-                    result["warnings"].append("This question might be outside my expertise area")
+        if self.check_off_topic:
+            if self.off_topic_pattern.search(user_input, input_lower):
+                result["warnings"].append(OFF_TOPIC_WARNING)
         
-        # Length checks
-        if len(user_input.strip()) < 3:
-            result["is_valid"] = False
-            result["reason"] = "Message is too short. Please provide more details."
-            return result
+        return result
+    
+    def validate_inputs(self, user_inputs: List[str]) -> List[Dict[str, Any]]:
+        """Validate a batch of inputs with one scan per category, same results as validate_input"""
+        problems = [_length_problem(user_input) for user_input in user_inputs]
+        # Only messages with an acceptable length are scanned
+        scanned = [i for i, problem in enumerate(problems) if not problem]
+        texts = [user_inputs[i] for i in scanned]
+        texts_lower = [text.lower() for text in texts]
         
-        if len(user_input) > 5000:
-            result["is_valid"] = False
-            result["reason"] = "Message is too long. Please break it into smaller parts."
-            return result
+        def scan(enabled: bool, matcher) -> List[bool]:
+            if enabled and texts:
+                return matcher.search_many(texts, texts_lower)
+            return [False] * len(texts)
         
-        return result
+        harmful = scan(self.check_harmful, self.harmful_pattern)
+        spam = scan(self.check_spam, self.spam_pattern)
+        profane = scan(self.check_profanity, self.profanity_pattern)
+        off_topic = scan(self.check_off_topic, self.off_topic_pattern)
+        
+        results = [
+            {"is_valid": not problem, "reason": problem, "filtered_content": user_input, "warnings": []}
+            for user_input, problem in zip(user_inputs, problems)
+        ]
+        for j, i in enumerate(scanned):
+            result = results[i]
+            if harmful[j] or spam[j]:
+                result["is_valid"] = False
+                result["reason"] = HARMFUL_REASON if harmful[j] else SPAM_REASON
+            else:
+                if profane[j]:
+                    result["warnings"].append(PROFANITY_WARNING)
+                if off_topic[j]:
+                    result["warnings"].append(OFF_TOPIC_WARNING)
+        return results
     
     def validate_output(self, ai_response: str) -> Dict[str, Any]:
         """Validate AI output for safety"""
@@ -119,42 +395,71 @@ class GuardrailsFilter:
         }
         
         # Check AI didn't generate harmful content
-        for pattern in self.harmful_patterns:
-            if re.search(pattern, ai_response.lower()):
-                result["is_valid"] = False
-                result["reason"] = "AI response contains unsafe content"
-                result["filtered_content"] = "I apologize, but I can't provide that information. Is there something else I can help you with?"
-                return result
+        if self.harmful_pattern.search(ai_response):
+            result["is_valid"] = False
+            result["reason"] = "AI response contains unsafe content"
+            result["filtered_content"] = "I apologize, but I can't provide that information. Is there something else I can help you with?"
+            return result
         
         return result
 
+# Instructions for the LLM summary of messages that left the history window
+SUMMARY_PROMPT = """Summarize the earlier part of this conversation for an assistant that will continue it.
+Preserve the user's goals and open issues, their current status, names, numbers, decisions, and anything the assistant committed to.
+Merge the previous summary with the new messages. Write at most 150 words of plain prose, without preamble."""
+
+# Python 3.10+ gives messages __slots__ (no per-instance __dict__); 3.8/3.9 keep plain dataclasses
+@dataclass(**({"slots": True} if sys.version_info >= (3, 10) else {}))
+class Message:
+    """One conversation history message ("user" or "assistant")"""
+    role: str
+    content: str
+    
+    def to_dict(self) -> Dict[str, str]:
+        return {"role": self.role, "content": self.content}
+
 class ConversationSummarizer:
     """Handles conversation summarization when context gets too long"""
     
+    def __init__(self, model=None, temperature: float = 0.3, max_tokens: int = 250):
+        # Gemini model for LLM summaries; without one only the keyword summary is used
+        self.model = model
+        self.generation_config = {"temperature": temperature, "max_output_tokens": max_tokens}
+    
+    async def summarize_with_model(self, messages: List[Message], previous_summary: str = "") -> str:
+        """Fold messages into the running summary with one low-temperature LLM call"""
+        transcript = "\n".join(
+            f"{'User' if msg.role == 'user' else 'Assistant'}: {msg.content}" for msg in messages
+        )
+        prompt = f"{SUMMARY_PROMPT}\n\nPrevious summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"
+        response = await self.model.generate_content_async(prompt, generation_config=self.generation_config)
+        return response.text.strip()
+    
     @staticmethod
-    def summarize_conversation(history: List[Dict[str, str]], keep_recent: int = 3) -> str:
+    def summarize_conversation(history: List[Message], keep_recent: int = 3) -> str:
         """Summarize older conversation history"""
         if len(history) <= keep_recent:
             return ""
         
         # Take messages to summarize (exclude recent ones)
-        to_summarize = history[:-keep_recent]
+        to_summarize = history[:len(history) - keep_recent]
         
         # Create summary
         summary_parts = []
         user_topics = []
         
         for msg in to_summarize:
-            role = msg["role"]
-            content = msg["content"]
+            role = msg.role
+            content = msg.content
             
             if role == "user":
                 # Extract key topics from user messages
-                if "how" in content.lower():
+                content_lower = content.lower()
+                if "how" in content_lower:
                     user_topics.append("asked about procedures")
-                elif "what" in content.lower():
+                elif "what" in content_lower:
                     user_topics.append("asked for definitions")
-                elif "why" in content.lower():
+                elif "why" in content_lower:
                     user_topics.append("asked for explanations")
                 else:
                     # Truncate long content
@@ -169,8 +474,13 @@ class ConversationSummarizer:
         
         return "Earlier conversation covered various topics."
 
-# Enhanced master prompt with better structure
-MASTER_PROMPT = """You are Nebula AI, an intelligent and helpful assistant with the following capabilities:
+# Messages shown under "Recent conversation" in the prompt
+RECENT_CONTEXT_MESSAGES = 6
+
+# Enhanced master prompt with better structure, split into a stable system
+# prefix (identical for every turn, so it can be cached server-side) and a
+# per-turn part
+SYSTEM_PROMPT = """You are Nebula AI, an intelligent and helpful assistant with the following capabilities:
 
 ## Core Identity & Behavior
 - You are knowledgeable, professional, and friendly
@@ -179,21 +489,6 @@ MASTER_PROMPT = """You are Nebula AI, an intelligent and helpful assistant with
 - You follow ethical guidelines and safety standards
 - You handle complex topics with clarity and precision
 
-## Response Guidelines
-- Format: {format_type}
-- Maximum response length: {max_tokens} tokens
-- Creativity level: {temperature}
-- Domain focus: {domain}
-- Current time: {current_time}
-
-## Conversation Context
-{conversation_context}
-
-## User Information
-- Session ID: {session_id}
-- User preferences: {user_preferences}
-- Primary domain: {domain}
-
 ## Content Guidelines
 - Allowed topics: {allowed_topics}
 - Keep responses appropriate and helpful
@@ -206,7 +501,7 @@ When responding in JSON format, use this structure:
 {{
     "response": {{
         "content": "Your detailed response here",
-        "format": "{format_type}",
+        "format": "json",
         "confidence": 0.9,
         "topic_category": "detected_category"
     }},
@@ -221,20 +516,62 @@ When responding in JSON format, use this structure:
         "clarifications_needed": false,
         "related_topics": ["topic1", "topic2"]
     }}
-}}
+}}"""
+
+# Per-turn part: session settings (rendered once per format/context) followed
+# by what changes every turn
+SESSION_PROMPT = """## Response Guidelines
+- Format: {format_type}
+- Maximum response length: {max_tokens} tokens
+- Creativity level: {temperature}
+- Domain focus: {domain}
+
+## User Information
+- Session ID: {session_id}
+- User preferences: {user_preferences}
+- Primary domain: {domain}"""
+
+TURN_PROMPT = """{session_block}
+
+## Conversation Context
+Current time: {current_time}
+{conversation_context}
 
 ## Current User Query
 {user_input}
 
 Please provide a helpful, accurate, and appropriately formatted response:"""
 
+# TURN_PROMPT is filled on every request: split it into (literal, field) pairs once
+# so rendering is a join instead of re-parsing the template with str.format
+_TURN_SEGMENTS = [(literal, field) for literal, field, _, _ in string.Formatter().parse(TURN_PROMPT)]
+
+def _render_turn_prompt(values: Dict[str, str]) -> str:
+    return "".join(literal + values[field] if field else literal for literal, field in _TURN_SEGMENTS)
+
 class PromptManager:
-    def __init__(self, config: Optional[PromptConfig] = None):
+    def __init__(self, config: Optional[PromptConfig] = None, summary_model=None):
         self.config = config or PromptConfig()
         self.guardrails = GuardrailsFilter(self.config)
-        self.summarizer = ConversationSummarizer()
-        self.conversation_history: List[Dict[str, str]] = []
+        self.summarizer = ConversationSummarizer(
+            summary_model, self.config.summary_temperature, self.config.summary_max_tokens
+        )
+        self.conversation_history = []  # also resets the formatted-lines cache
         self.conversation_summary = ""
+        
+        # Evicted messages waiting for the background LLM summary (one call in flight at a time)
+        self._pending_summary: List[Message] = []
+        self._summary_task: Optional[asyncio.Task] = None
+        self._llm_summary = ""  # cumulative, unlike the keyword summary of the latest evictions
+        
+        # The system prefix only depends on config, so render it once
+        self.system_prompt = SYSTEM_PROMPT.format(
+            allowed_topics=", ".join(self.config.allowed_topics or ["general"])
+        )
+        self._session_block_key: Optional[tuple] = None
+        self._session_block = ""
+        self._time_second = -1
+        self._time_text = ""
     
     def build_prompt(self, 
                     user_input: str,
@@ -256,44 +593,98 @@ class PromptManager:
                 ]
             }
         
-        # Manage conversation history
-        if len(self.conversation_history) > self.config.summary_threshold:
-            self.conversation_summary = self.summarizer.summarize_conversation(
-                self.conversation_history,
-                keep_recent=self.config.max_history
-            )
-            # Keep only recent messages
-            self.conversation_history = self.conversation_history[-self.config.max_history:]
-        
         # Build context
         conversation_context = self._format_conversation_context()
         
-        # Prepare context variables
+        # Build final prompt: stable prefix + per-turn delta
         context = context or {}
-        prompt_vars = {
-            "format_type": format_type,
-            "max_tokens": self.config.max_tokens,
-            "temperature": self.config.temperature,
+        turn_prompt = _render_turn_prompt({
+            "session_block": self._get_session_block(format_type, context),
+            "current_time": self._current_time(),
             "conversation_context": conversation_context,
-            "session_id": context.get("session_id", "unknown"),
-            "user_preferences": json.dumps(context.get("user_preferences", {})),
-            "domain": context.get("domain", "general"),
-            "allowed_topics": ", ".join(self.config.allowed_topics or ["general"]),
-            "user_input": user_input,
-            "current_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S UTC")
-        }
-        
-        # Build final prompt
-        final_prompt = MASTER_PROMPT.format(**prompt_vars)
+            "user_input": user_input
+        })
+        final_prompt = f"{self.system_prompt}\n\n{turn_prompt}"
         
         return {
             "error": False,
             "prompt": final_prompt,
+            "prefix": self.system_prompt,
+            "delta": turn_prompt,
             "warnings": input_validation.get("warnings", []),
             "context": context,
-            "estimated_tokens": len(final_prompt.split()) * 1.3  # Rough estimate
+            "estimated_tokens": len(final_prompt) / 4  # Rough estimate (~4 characters per Gemini token)
         }
     
+    def _current_time(self) -> str:
+        """Prompt timestamp, formatted at most once per second"""
+        second = int(time.time())
+        if second != self._time_second:
+            self._time_text = datetime.fromtimestamp(second).strftime("%Y-%m-%d %H:%M:%S UTC")
+            self._time_second = second
+        return self._time_text
+    
+    def _get_session_block(self, format_type: str, context: Dict) -> str:
+        """Render SESSION_PROMPT, reusing the last rendering while its inputs are unchanged"""
+        preferences = context.get("user_preferences", {})
+        # Keyed by the preference items, not id(preferences): update_preferences edits the dict in place
+        key = (
+            format_type,
+            context.get("session_id", "unknown"),
+            context.get("domain", "general"),
+            tuple(preferences.items())
+        )
+        if key != self._session_block_key:
+            self._session_block = SESSION_PROMPT.format(
+                format_type=format_type,
+                max_tokens=self.config.max_tokens,
+                temperature=self.config.temperature,
+                domain=key[2],
+                session_id=key[1],
+                user_preferences=json.dumps(preferences)
+            )
+            self._session_block_key = key
+        return self._session_block
+    
+    @property
+    def conversation_history(self) -> List[Dict[str, str]]:
+        """Snapshot of the history window as role/content dicts.
+        
+        Built fresh on each access, so mutating it has no effect: append through
+        add_to_history and replace the whole history by assigning this property.
+        """
+        return [msg.to_dict() for msg in self._conversation_history]
+    
+    @conversation_history.setter
+    def conversation_history(self, history: List[Dict[str, str]]):
+        # Replacing the history (load, clear) rebuilds the bounded window and formatted tail once
+        messages = [Message(msg["role"], msg["content"]) for msg in history]
+        if len(messages) > self.config.max_history:
+            # Messages beyond the window only survive in the summary
+            self.conversation_summary = self.summarizer.summarize_conversation(
+                messages,
+                keep_recent=self.config.max_history
+            )
+        self._conversation_history: Deque[Message] = deque(messages, maxlen=self.config.max_history)
+        # Running per-role counts for get_conversation_stats
+        self._user_count = sum(1 for msg in self._conversation_history if msg.role == "user")
+        self._assistant_count = sum(1 for msg in self._conversation_history if msg.role == "assistant")
+        start = max(0, len(self._conversation_history) - RECENT_CONTEXT_MESSAGES)
+        self._recent_lines: Deque[str] = deque(
+            map(self._format_history_line, islice(self._conversation_history, start, None)),
+            maxlen=RECENT_CONTEXT_MESSAGES
+        )
+    
+    @staticmethod
+    def _format_history_line(msg: Message) -> str:
+        """Format one history message for the prompt (without its position number)"""
+        role = "User" if msg.role == "user" else "Assistant"
+        content = msg.content
+        # Truncate very long messages
+        if len(content) > 300:
+            content = content[:300] + "... [truncated]"
+        return f"{role}: {content}"
+    
     def _format_conversation_context(self) -> str:
         """Format conversation history for prompt inclusion"""
         context_parts = []
@@ -302,16 +693,10 @@ class PromptManager:
         if self.conversation_summary:
             context_parts.append(f"Previous context: {self.conversation_summary}")
         
-        # Add recent conversation
-        if self.conversation_history:
+        # Add recent conversation (lines are formatted once, as messages arrive)
+        if self._recent_lines:
             context_parts.append("Recent conversation:")
-            for i, msg in enumerate(self.conversation_history[-6:]):  # Last 6 messages
-                role = "User" if msg["role"] == "user" else "Assistant"
-                content = msg["content"]
-                # Truncate very long messages
-                if len(content) > 300:
-                    content = content[:300] + "... [truncated]"
-                context_parts.append(f"{i+1}. {role}: {content}")
+            context_parts.extend(f"{i}. {line}" for i, line in enumerate(self._recent_lines, 1))
         else:
             context_parts.append("This is the start of a new conversation.")
         
@@ -319,10 +704,54 @@ class PromptManager:
     
     def add_to_history(self, user_input: str, ai_response: str):
         """Add interaction to conversation history"""
-        self.conversation_history.extend([
-            {"role": "user", "content": user_input},
-            {"role": "assistant", "content": ai_response}
-        ])
+        user_msg = Message("user", user_input)
+        ai_msg = Message("assistant", ai_response)
+        
+        # The bounded deque drops its oldest messages as these arrive; summarize those first
+        evicted = len(self._conversation_history) + 2 - self.config.max_history
+        if evicted > 0:
+            dropped = list(islice(self._conversation_history, evicted))
+            if not self._schedule_summary(dropped):
+                self.conversation_summary = self.summarizer.summarize_conversation(dropped, keep_recent=0)
+            for msg in dropped:
+                if msg.role == "user":
+                    self._user_count -= 1
+                elif msg.role == "assistant":
+                    self._assistant_count -= 1
+        self._conversation_history.extend([user_msg, ai_msg])
+        self._user_count += 1
+        self._assistant_count += 1
+        self._recent_lines.append(self._format_history_line(user_msg))
+        self._recent_lines.append(self._format_history_line(ai_msg))
+    
+    def _schedule_summary(self, dropped: List[Message]) -> bool:
+        """Queue evicted messages for an LLM summary; False if it can't run here"""
+        if self.summarizer.model is None:
+            return False
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return False  # sync caller without an event loop
+        
+        # Keep some context for the next prompt until the first LLM summary lands
+        if not self.conversation_summary:
+            self.conversation_summary = self.summarizer.summarize_conversation(dropped, keep_recent=0)
+        self._pending_summary.extend(dropped)
+        if self._summary_task is None or self._summary_task.done():
+            self._summary_task = asyncio.create_task(self._refresh_summary())
+        return True
+    
+    async def _refresh_summary(self):
+        """Fold pending messages into the cumulative summary in the background"""
+        while self._pending_summary:
+            # Messages evicted while a call is in flight are batched into the next one
+            messages, self._pending_summary = self._pending_summary, []
+            try:
+                self._llm_summary = await self.summarizer.summarize_with_model(messages, self._llm_summary)
+                self.conversation_summary = self._llm_summary
+            except Exception as e:
+                logger.warning("LLM summary failed, using keyword summary: %s", e)
+                self.conversation_summary = self.summarizer.summarize_conversation(messages, keep_recent=0)
     
     def validate_ai_response(self, response: str) -> Dict[str, Any]:
         """Validate AI response before returning to user"""
@@ -330,19 +759,20 @@ class PromptManager:
     
     def clear_history(self):
         """Clear conversation history"""
+        if self._summary_task is not None:
+            self._summary_task.cancel()
+            self._summary_task = None
+        self._pending_summary = []
+        self._llm_summary = ""
         self.conversation_history = []
         self.conversation_summary = ""
     
     def get_conversation_stats(self) -> Dict[str, Any]:
         """Get statistics about the current conversation"""
-        total_messages = len(self.conversation_history)
-        user_messages = len([msg for msg in self.conversation_history if msg["role"] == "user"])
-        assistant_messages = len([msg for msg in self.conversation_history if msg["role"] == "assistant"])
-        
         return {
-            "total_messages": total_messages,
-            "user_messages": user_messages,
-            "assistant_messages": assistant_messages,
+            "total_messages": len(self._conversation_history),
+            "user_messages": self._user_count,
+            "assistant_messages": self._assistant_count,
             "has_summary": bool(self.conversation_summary),
             "summary_length": len(self.conversation_summary) if self.conversation_summary else 0
         }